@@ -0,0 +1,38 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+from backend.db import use_primary
+
+TOKEN_KEY = 'auth_token:{}'
+
+
+def get_token_cache_key(key):
+    """Ключ кеша по хешу токена, чтобы сам токен не хранился в кеше."""
+    return TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def invalidate_token(key):
+    caches[settings.AUTH_TOKEN_CACHE_ALIAS].delete(get_token_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, который хранит токен вместе с пользователем
+    в кеше AUTH_TOKEN_CACHE_TIMEOUT секунд. Запись удаляется сигналами
+    при удалении токена (в том числе при выходе) и при изменении
+    пользователя, например при его деактивации. Токен читается
+    с основной базы: на реплике только что выданного может не быть.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+        cache_key = get_token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            with use_primary():
+                user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        return token.user, token
@@ -0,0 +1,168 @@
+from django.db import connections, router, transaction
+from rest_framework.response import Response
+
+from recipes.models import Favorite, ShoppingCart
+from recipes.signals import change_counters, get_counter
+from .relations import invalidate_user_relations
+from .response_cache import bump_generations
+from .serializers import BulkIdsSerializer
+
+ADDED = 'added'
+REMOVED = 'removed'
+NOT_FOUND = 'not_found'
+ALREADY_ADDED = 'already_added'
+NOT_ADDED = 'not_added'
+FORBIDDEN = 'forbidden'
+
+RECIPE_ERRORS = {
+    NOT_FOUND: 'Рецепт не найден!',
+    ALREADY_ADDED: 'Рецепт уже добавлен!',
+    NOT_ADDED: 'Рецепт уже удален!',
+}
+AUTHOR_ERRORS = {
+    NOT_FOUND: 'Автор не найден!',
+    ALREADY_ADDED: 'Вы уже подписаны на этого пользователя!',
+    NOT_ADDED: 'Вы не подписаны на этого пользователя!',
+    FORBIDDEN: 'Нельзя подписаться на самого себя!',
+}
+
+
+def relations_changed(model, user):
+    """То же, что делают сигналы модели, один раз на всю пачку."""
+    invalidate_user_relations(user.pk)
+    if model in (Favorite, ShoppingCart):
+        bump_generations(['counters'])
+
+
+def supports_returning(connection):
+    """INSERT и DELETE с RETURNING: PostgreSQL и SQLite начиная с 3.35."""
+    if connection.vendor == 'postgresql':
+        return True
+    return (connection.vendor == 'sqlite'
+            and connection.Database.sqlite_version_info >= (3, 35))
+
+
+def write_links(connection, build_sql, column, pks):
+    """
+    Выполняет INSERT или DELETE, построенный build_sql(pks), и
+    возвращает pk строк, которые действительно изменил этот запрос.
+    С RETURNING - одним запросом, без него - по запросу на строку
+    с проверкой rowcount.
+    """
+    with connection.cursor() as cursor:
+        if supports_returning(connection):
+            sql, params = build_sql(pks)
+            cursor.execute(f'{sql} RETURNING {column}', params)
+            return {pk for pk, in cursor.fetchall()}
+        changed = set()
+        for pk in pks:
+            cursor.execute(*build_sql([pk]))
+            if cursor.rowcount == 1:
+                changed.add(pk)
+        return changed
+
+
+def get_columns(model, foreign_key, connection):
+    quote_name = connection.ops.quote_name
+    return (
+        quote_name(model._meta.db_table),
+        quote_name(model._meta.get_field('user').column),
+        quote_name(model._meta.get_field(foreign_key).column),
+    )
+
+
+def bulk_add(model, user, ids, forbidden=()):
+    """
+    Добавляет связи пользователя с объектами ids. Проверка и запись
+    идут в одной транзакции, а добавленными считаются только строки,
+    которые вернул INSERT ... ON CONFLICT DO NOTHING RETURNING: строку,
+    вставленную параллельным запросом, этот запрос не засчитывает.
+    Сигналы не отправляются, счётчики меняются одним UPDATE на пачку.
+    Возвращает список пар (id, статус) в порядке ids.
+    """
+    target, foreign_key, field = get_counter(model)
+    using = router.db_for_write(model)
+    connection = connections[using]
+    ops = connection.ops
+    table, user_column, column = get_columns(model, foreign_key, connection)
+
+    def build_sql(pks):
+        sql = '{} {} ({}, {}) VALUES {} {}'.format(
+            ops.insert_statement(ignore_conflicts=True), table, user_column,
+            column, ', '.join(['(%s, %s)'] * len(pks)),
+            ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+        )
+        return sql, [value for pk in pks for value in (user.pk, pk)]
+
+    with transaction.atomic(using=using):
+        existing = set(target.objects.using(using).filter(
+            pk__in=ids
+        ).values_list('pk', flat=True))
+        candidates = [
+            pk for pk in ids if pk in existing and pk not in forbidden
+        ]
+        added = set()
+        if candidates:
+            added = write_links(connection, build_sql, column, candidates)
+        if added:
+            change_counters(target, added, field, 1)
+            transaction.on_commit(lambda: relations_changed(model, user))
+    results = []
+    for pk in ids:
+        if pk not in existing:
+            status = NOT_FOUND
+        elif pk in forbidden:
+            status = FORBIDDEN
+        elif pk in added:
+            status = ADDED
+        else:
+            status = ALREADY_ADDED
+        results.append((pk, status))
+    return results
+
+
+def bulk_remove(model, user, ids):
+    """
+    Удаляет связи пользователя с объектами ids одним DELETE ...
+    RETURNING: удалёнными считаются и уменьшают счётчики только
+    строки, которые удалил этот запрос.
+    Возвращает список пар (id, статус) в порядке ids.
+    """
+    target, foreign_key, field = get_counter(model)
+    using = router.db_for_write(model)
+    connection = connections[using]
+    table, user_column, column = get_columns(model, foreign_key, connection)
+
+    def build_sql(pks):
+        sql = 'DELETE FROM {} WHERE {} = %s AND {} IN ({})'.format(
+            table, user_column, column, ', '.join(['%s'] * len(pks))
+        )
+        return sql, [user.pk, *pks]
+
+    with transaction.atomic(using=using):
+        removed = write_links(connection, build_sql, column, ids)
+        if removed:
+            change_counters(target, removed, field, -1)
+            transaction.on_commit(lambda: relations_changed(model, user))
+    return [(pk, REMOVED if pk in removed else NOT_ADDED) for pk in ids]
+
+
+def bulk_response(request, model, errors, forbidden=()):
+    """
+    Ответ на POST или DELETE со списком ids: результат для каждого id,
+    у неудачных - ещё и текст ошибки.
+    """
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    if request.method == 'POST':
+        results = bulk_add(model, request.user, ids, forbidden)
+    else:
+        results = bulk_remove(model, request.user, ids)
+    data = []
+    for pk, status in results:
+        item = {'id': pk, 'status': status}
+        if status in errors:
+            item['errors'] = errors[status]
+        data.append(item)
+    return Response({'results': data})
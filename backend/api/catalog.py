@@ -0,0 +1,172 @@
+import time
+from array import array
+from bisect import bisect_left
+from threading import local
+from uuid import uuid4
+
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.dispatch import receiver
+
+from backend.db import use_primary
+from recipes.models import CatalogVersion, Ingredient, Tag
+from .search import IngredientIndex, search_ingredient_ids_postgresql
+
+CATALOG_VERSION_ID = 1
+
+_catalog = None
+# Версия, прочитанная в текущем запросе. Вне запросов (команды,
+# shell) она читается из базы при каждом обращении.
+_request = local()
+
+
+@receiver(request_started)
+def start_request(**kwargs):
+    _request.active = True
+    _request.catalog_version = None
+
+
+@receiver(request_finished)
+def finish_request(**kwargs):
+    _request.active = False
+    _request.catalog_version = None
+
+
+def new_catalog_version():
+    """Версия вида '<unix-время>.<случайная часть>'."""
+    return f'{int(time.time())}.{uuid4().hex}'
+
+
+def get_catalog_version():
+    """Версия каталога из базы, за запрос - не больше одного чтения."""
+    version = getattr(_request, 'catalog_version', None)
+    if version is None:
+        version = CatalogVersion.objects.filter(
+            pk=CATALOG_VERSION_ID
+        ).values_list('version', flat=True).first()
+        if version is None:
+            version = CatalogVersion.objects.get_or_create(
+                pk=CATALOG_VERSION_ID,
+                defaults={'version': new_catalog_version()}
+            )[0].version
+        if getattr(_request, 'active', False):
+            _request.catalog_version = version
+    return version
+
+
+def get_catalog_modified(version):
+    """Время изменения каталога, записанное в его версии."""
+    try:
+        return int(version.split('.', 1)[0])
+    except ValueError:
+        return None
+
+
+def bump_catalog_version():
+    """Помечает каталог устаревшим во всех процессах."""
+    _request.catalog_version = None
+    CatalogVersion.objects.update_or_create(
+        pk=CATALOG_VERSION_ID, defaults={'version': new_catalog_version()}
+    )
+
+
+class Catalog:
+    """
+    Теги и ингредиенты в памяти процесса.
+
+    Ингредиенты хранятся в параллельных массивах, отсортированных по id:
+    единицы измерения повторяются, поэтому хранится только их номер.
+    Объекты моделей создаются по запросу и в БД не обращаются.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.tags = list(Tag.objects.order_by('id'))
+        self.tags_by_id = {tag.id: tag for tag in self.tags}
+
+        units = {}
+        self.ingredient_ids = array('q')
+        self.ingredient_names = []
+        self.ingredient_units = array('H')
+        rows = Ingredient.objects.order_by('id').values_list(
+            'id', 'name', 'measurement_unit'
+        )
+        for pk, name, measurement_unit in rows.iterator():
+            self.ingredient_ids.append(pk)
+            self.ingredient_names.append(name)
+            self.ingredient_units.append(
+                units.setdefault(measurement_unit, len(units))
+            )
+        self.units = list(units)
+        self.name_order = array('L', sorted(
+            range(len(self.ingredient_names)),
+            key=self.ingredient_names.__getitem__
+        ))
+        self._search_index = None
+        self._memo = {}
+
+    def get_tag(self, pk):
+        try:
+            return self.tags_by_id.get(int(pk))
+        except (TypeError, ValueError):
+            return None
+
+    def get_ingredient(self, pk):
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+        position = bisect_left(self.ingredient_ids, pk)
+        if (position == len(self.ingredient_ids)
+                or self.ingredient_ids[position] != pk):
+            return None
+        return self.build_ingredient(position)
+
+    def get_ingredients(self, ids):
+        """Ингредиенты по списку id в том же порядке, без отсутствующих."""
+        ingredients = (self.get_ingredient(pk) for pk in ids)
+        return [ingredient for ingredient in ingredients if ingredient]
+
+    def ingredient_list(self):
+        """Все ингредиенты в порядке Ingredient.Meta.ordering."""
+        return [
+            self.build_ingredient(position) for position in self.name_order
+        ]
+
+    def build_ingredient(self, position):
+        return Ingredient(
+            id=self.ingredient_ids[position],
+            name=self.ingredient_names[position],
+            measurement_unit=self.units[self.ingredient_units[position]],
+        )
+
+    def search_ingredients(self, query, limit):
+        """Ингредиенты, подходящие под запрос, в порядке релевантности."""
+        query = query.strip().lower()
+        if not query:
+            return []
+        if connection.vendor == 'postgresql':
+            ids = search_ingredient_ids_postgresql(query, limit)
+        else:
+            if self._search_index is None:
+                self._search_index = IngredientIndex(
+                    zip(self.ingredient_ids, self.ingredient_names)
+                )
+            ids = self._search_index.search(query, limit)
+        return self.get_ingredients(ids)
+
+    def memoize(self, key, factory):
+        """Значение, вычисляемое один раз для текущей версии каталога."""
+        if key not in self._memo:
+            self._memo[key] = factory()
+        return self._memo[key]
+
+
+def get_catalog():
+    """Каталог текущей версии; перечитывается из БД после изменений."""
+    global _catalog
+    version = get_catalog_version()
+    if _catalog is None or _catalog.version != version:
+        with use_primary():
+            _catalog = Catalog(version)
+    return _catalog
@@ -0,0 +1,94 @@
+import base64
+import binascii
+import hashlib
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework.fields import ImageField
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from .catalog import get_catalog
+
+# Длина фрагмента base64, кратная 4, чтобы каждый декодировался отдельно.
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+class ChunkedBase64ImageField(Base64ImageField):
+    """
+    Base64ImageField, декодирующий картинку фрагментами.
+
+    Строка base64 уже целиком в памяти (её разобрал парсер JSON),
+    но декодированный файл не создаётся одной копией: фрагменты пишутся
+    во временный файл, который уходит на диск после
+    FILE_UPLOAD_MAX_MEMORY_SIZE. Имя файла строится по хэшу содержимого.
+    """
+
+    def decode_to_file(self, base64_data):
+        """Декодирует base64 во временный файл, считая хэш по пути."""
+        # Переносы строк и пробелы сдвинули бы границы фрагментов.
+        base64_data = ''.join(base64_data.split())
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        digest = hashlib.sha256()
+        try:
+            for start in range(0, len(base64_data), BASE64_CHUNK_SIZE):
+                chunk = base64.b64decode(
+                    base64_data[start:start + BASE64_CHUNK_SIZE]
+                )
+                digest.update(chunk)
+                file.write(chunk)
+        except (TypeError, binascii.Error, ValueError):
+            file.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        return file, digest
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+
+        content_type = None
+        if ';base64,' in base64_data:
+            header, _, base64_data = base64_data.partition(';base64,')
+            if self.trust_provided_content_type:
+                content_type = header.replace('data:', '')
+
+        file, digest = self.decode_to_file(base64_data)
+        size = file.tell()
+        file.seek(0)
+        try:
+            extension = Image.open(file).format.lower()
+        except (OSError, AttributeError):
+            file.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        file.seek(0)
+        extension = 'jpg' if extension == 'jpeg' else extension
+        if extension not in self.ALLOWED_TYPES:
+            file.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+
+        data = UploadedFile(
+            file=file,
+            name=f'{digest.hexdigest()[:16]}.{extension}',
+            content_type=content_type,
+            size=size,
+        )
+        return ImageField.to_internal_value(self, data)
+
+
+class CatalogTagField(PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField для тегов, проверяющий id по каталогу."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not isinstance(data, (int, str)):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        tag = get_catalog().get_tag(data)
+        if tag is None:
+            self.fail('does_not_exist', pk_value=data)
+        return tag
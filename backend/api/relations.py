@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import IntegerField, Value
+
+from backend.db import use_primary
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscribe
+
+RELATIONS_KEY = 'user_relations:{}'
+FAVORITE, SHOPPING_CART, SUBSCRIPTION = range(3)
+
+
+class UserRelations:
+    """
+    Id избранных рецептов, рецептов в списке покупок и авторов
+    в подписках пользователя. По ним считаются флаги is_favorited,
+    is_in_shopping_cart и is_subscribed без запросов на каждый объект.
+    """
+
+    def __init__(self, favorites=(), shopping_cart=(), subscriptions=()):
+        self.favorites = frozenset(favorites)
+        self.shopping_cart = frozenset(shopping_cart)
+        self.subscriptions = frozenset(subscriptions)
+
+    @classmethod
+    def load(cls, user):
+        """Все три множества одним запросом."""
+        rows = Favorite.objects.filter(user=user).order_by().annotate(
+            kind=Value(FAVORITE, IntegerField())
+        ).values_list('recipe_id', 'kind').union(
+            ShoppingCart.objects.filter(user=user).order_by().annotate(
+                kind=Value(SHOPPING_CART, IntegerField())
+            ).values_list('recipe_id', 'kind'),
+            Subscribe.objects.filter(user=user).order_by().annotate(
+                kind=Value(SUBSCRIPTION, IntegerField())
+            ).values_list('author_id', 'kind'),
+            all=True
+        )
+        ids = ([], [], [])
+        for pk, kind in rows:
+            ids[kind].append(pk)
+        return cls(*ids)
+
+    def get_flags(self, recipe_id, author_id):
+        return (
+            recipe_id in self.favorites,
+            recipe_id in self.shopping_cart,
+            author_id in self.subscriptions,
+        )
+
+
+EMPTY_RELATIONS = UserRelations()
+
+
+def get_user_relations(request):
+    """
+    Связи текущего пользователя: один раз за запрос, между запросами -
+    из кеша на USER_RELATIONS_TIMEOUT секунд. Кеш общий, поэтому
+    заполняется с основной базы, а не с отстающей реплики.
+    """
+    if request is None or not request.user.is_authenticated:
+        return EMPTY_RELATIONS
+    relations = getattr(request, 'user_relations', None)
+    if relations is None:
+        key = RELATIONS_KEY.format(request.user.pk)
+        relations = cache.get(key)
+        if relations is None:
+            with use_primary():
+                relations = UserRelations.load(request.user)
+            cache.set(key, relations, settings.USER_RELATIONS_TIMEOUT)
+        request.user_relations = relations
+    return relations
+
+
+def get_context_relations(context):
+    """Связи из контекста сериализатора, если вьюсет их передал."""
+    relations = context.get('relations')
+    if relations is None:
+        return get_user_relations(context.get('request'))
+    return relations
+
+
+def invalidate_user_relations(user_id):
+    cache.delete(RELATIONS_KEY.format(user_id))
+
+
+def overlay_recipe(data, relations):
+    """Накладывает флаги пользователя на общий для всех ответ."""
+    (data['is_favorited'], data['is_in_shopping_cart'],
+     data['author']['is_subscribed']) = relations.get_flags(
+        data['id'], data['author']['id']
+    )
+    return data
@@ -0,0 +1,45 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Рендерер формата выгрузки списка покупок.
+    Сам список отдаётся потоком из вьюсета, через рендерер проходят
+    только служебные ответы (ошибки, статус подготовки pdf).
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False)
+
+
+class PDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class PlainTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class MarkdownRenderer(ShoppingListRenderer):
+    media_type = 'text/markdown'
+    format = 'md'
+
+
+# Первый рендерер используется по умолчанию, если клиент не указал формат.
+SHOPPING_LIST_RENDERERS = (
+    PDFRenderer,
+    PlainTextRenderer,
+    CSVRenderer,
+    JSONRenderer,
+    MarkdownRenderer,
+)
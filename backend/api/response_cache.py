@@ -0,0 +1,109 @@
+import hashlib
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .catalog import get_catalog, get_catalog_version
+
+GENERATION_PREFIX = 'recipes:generation:'
+# Параметры ленты, от которых зависит общая для всех часть ответа.
+LIST_PARAMS = ('author', 'search', 'page', 'limit', 'cursor', 'ordering')
+# Фильтры, от которых ответ зависит только у авторизованных.
+PERSONAL_PARAMS = ('is_favorited', 'is_in_shopping_cart')
+# Поля сортировки, значения которых меняются без изменения рецепта.
+COUNTER_FIELDS = ('favorites_count', 'cart_count')
+
+
+def get_response_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def get_generations(scopes):
+    """
+    Текущие метки областей кеша. Метка - случайная строка, поэтому
+    потеря ключа в кеше только сбрасывает зависящие от неё ответы.
+    """
+    cache = get_response_cache()
+    keys = [GENERATION_PREFIX + scope for scope in scopes]
+    generations = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in generations}
+    if missing:
+        cache.set_many(missing, None)
+        generations.update(missing)
+    return [generations[key] for key in keys]
+
+
+def bump_generations(scopes):
+    """Сбрасывает все закешированные ответы из областей scopes."""
+    get_response_cache().set_many(
+        {GENERATION_PREFIX + scope: uuid4().hex for scope in scopes}, None
+    )
+
+
+def build_cache_key(request, kind, scopes, params):
+    """
+    Ключ ответа: метки областей, версия каталога, адрес сайта
+    (ссылки в ответе абсолютные) и нормализованные параметры.
+    """
+    parts = [get_catalog_version(), request.build_absolute_uri('/')]
+    parts += get_generations(scopes)
+    parts += [f'{name}={value}' for name, value in params]
+    digest = hashlib.sha256('|'.join(parts).encode()).hexdigest()
+    return f'recipes:{kind}:{digest}'
+
+
+def get_list_cache_key(request):
+    """
+    Ключ ленты или None, если ответ не кешируется: для пользователя
+    с фильтрами по избранному и списку покупок.
+    Областью ленты служат выбранные теги и автор, без фильтров - 'all'.
+    """
+    query = request.query_params
+    if request.user.is_authenticated and any(
+            name in query for name in PERSONAL_PARAMS):
+        return None
+    catalog = get_catalog()
+    tag_ids = catalog.memoize('tag_ids_by_slug', lambda: {
+        tag.slug: tag.id for tag in catalog.tags
+    })
+    try:
+        tags = sorted({tag_ids[slug] for slug in query.getlist('tags')})
+        author = int(query['author']) if query.get('author') else None
+    except (KeyError, ValueError):
+        return None
+    scopes = [f'tag:{tag}' for tag in tags]
+    if author is not None:
+        scopes.append(f'author:{author}')
+    if not scopes:
+        scopes.append('all')
+    ordering = query.get('ordering', '')
+    if any(field in ordering for field in COUNTER_FIELDS):
+        scopes.append('counters')
+    params = [('tags', ','.join(map(str, tags)))] + [
+        (name, query[name]) for name in LIST_PARAMS if name in query
+    ]
+    return build_cache_key(request, 'list', scopes, params)
+
+
+def get_detail_cache_key(request, pk):
+    return build_cache_key(request, 'detail', [f'recipe:{pk}'], [('pk', pk)])
+
+
+def get_cached_response(key):
+    if key is None:
+        return None
+    return get_response_cache().get(key)
+
+
+def cache_response(key, value):
+    if key is not None:
+        get_response_cache().set(key, value)
+
+
+def invalidate_recipe(recipe_id, author_id, tag_ids):
+    """Сбрасывает рецепт и все ленты, в которых он мог оказаться."""
+    bump_generations(
+        ['all', f'recipe:{recipe_id}', f'author:{author_id}']
+        + [f'tag:{tag_id}' for tag_id in tag_ids]
+    )
@@ -0,0 +1,183 @@
+import re
+from bisect import bisect_left
+
+from django.db import connections
+from django.db.models import (BooleanField, Case, FloatField, IntegerField,
+                              Q, Value, When)
+from django.db.models.expressions import RawSQL
+
+from recipes.fulltext import FTS_TABLE
+from recipes.models import Ingredient
+
+# Минимальная длина запроса для поиска с опечатками.
+FUZZY_MIN_LENGTH = 3
+# Порог похожести pg_trgm для поиска с опечатками на PostgreSQL.
+TRIGRAM_THRESHOLD = 0.3
+# Веса названия и описания рецепта для bm25 на SQLite.
+FTS_WEIGHTS = (10.0, 1.0)
+WORDS = re.compile(r'\w+')
+
+
+def allowed_typos(query):
+    return 1 if len(query) <= 5 else 2
+
+
+def common_prefix_length(first, second):
+    length = 0
+    for first_char, second_char in zip(first, second):
+        if first_char != second_char:
+            break
+        length += 1
+    return length
+
+
+class IngredientIndex:
+    """
+    Отсортированный массив названий ингредиентов в памяти процесса.
+    Префиксный поиск делается бинарным поиском, поиск с опечатками
+    ограничен названиями на ту же первую букву.
+    """
+
+    def __init__(self, rows):
+        entries = sorted((name.lower(), pk) for pk, name in rows)
+        self.names = [name for name, _ in entries]
+        self.ids = [pk for _, pk in entries]
+
+    def prefix_range(self, prefix):
+        start = bisect_left(self.names, prefix)
+        end = bisect_left(self.names, prefix + '\uffff', start)
+        return start, end
+
+    def search(self, query, limit):
+        start, end = self.prefix_range(query)
+        positions = list(range(start, min(end, start + limit)))
+        if len(positions) < limit:
+            positions += [
+                position for position, name in enumerate(self.names)
+                if query in name and not name.startswith(query)
+            ][:limit - len(positions)]
+        if len(positions) < limit and len(query) >= FUZZY_MIN_LENGTH:
+            positions += self.fuzzy_search(
+                query, limit - len(positions), set(positions)
+            )
+        return [self.ids[position] for position in positions]
+
+    def fuzzy_search(self, query, limit, exclude):
+        """
+        Префиксное расстояние Левенштейна до названий на ту же букву.
+        Соседние названия в массиве отсортированы, поэтому строки
+        таблицы для общего префикса переиспользуются, как при обходе trie.
+        """
+        max_distance = allowed_typos(query)
+        depth = len(query) + max_distance
+        start, end = self.prefix_range(query[0])
+        rows = [list(range(len(query) + 1))]
+        previous_name = ''
+        matches = []
+        for position in range(start, end):
+            name = self.names[position][:depth]
+            common = min(
+                common_prefix_length(name, previous_name), len(rows) - 1
+            )
+            del rows[common + 1:]
+            previous_name = name
+            for name_char in name[common:]:
+                previous = rows[-1]
+                row = [previous[0] + 1]
+                for j, query_char in enumerate(query, 1):
+                    row.append(min(
+                        previous[j] + 1,
+                        row[j - 1] + 1,
+                        previous[j - 1] + (query_char != name_char),
+                    ))
+                rows.append(row)
+                if min(row) > max_distance:
+                    break
+            if position in exclude:
+                continue
+            distance = min(row[-1] for row in rows[1:len(name) + 1])
+            if distance <= max_distance:
+                length_gap = abs(len(self.names[position]) - len(query))
+                matches.append((distance, length_gap, position))
+        return [position for *_, position in sorted(matches)[:limit]]
+
+
+def search_ingredient_ids_postgresql(query, limit):
+    """
+    Поиск без учёта регистра по индексам на upper(name)
+    (text_pattern_ops и gin_trgm_ops, миграция 0018): сначала
+    совпадения по началу названия, затем по подстроке, затем похожие
+    по триграммам.
+    """
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    ids = list(Ingredient.objects.filter(name__icontains=query).annotate(
+        rank=Case(
+            When(name__istartswith=query, then=0),
+            default=1,
+            output_field=IntegerField()
+        )
+    ).order_by('rank', 'name').values_list('id', flat=True)[:limit])
+    if len(ids) < limit and len(query) >= FUZZY_MIN_LENGTH:
+        ids += Ingredient.objects.annotate(
+            similarity=TrigramSimilarity('name', query)
+        ).filter(similarity__gt=TRIGRAM_THRESHOLD).exclude(
+            name__contains=query
+        ).order_by('-similarity', 'name').values_list(
+            'id', flat=True
+        )[:limit - len(ids)]
+    return ids
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты, в названии или описании которых есть все слова запроса,
+    по убыванию релевантности, затем по дате. Запрос без слов
+    ничего не фильтрует.
+    """
+    words = WORDS.findall(query.lower())
+    if not words:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        queryset = search_recipes_postgresql(queryset, query)
+    elif vendor == 'sqlite':
+        queryset = search_recipes_sqlite(queryset, words)
+    else:
+        for word in words:
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(text__icontains=word)
+            )
+        queryset = queryset.alias(search_rank=Value(0.0))
+    return queryset.order_by('-search_rank', '-pub_date', '-id')
+
+
+def search_recipes_postgresql(queryset, query):
+    """
+    Поиск по GIN-индексу на search_vector. websearch_to_tsquery
+    понимает кавычки, or и минус и не падает на спецсимволах.
+    """
+    tsquery = "websearch_to_tsquery('russian', %s)"
+    return queryset.filter(RawSQL(
+        f'recipes_recipe.search_vector @@ {tsquery}', (query,),
+        output_field=BooleanField()
+    )).alias(search_rank=RawSQL(
+        f'ts_rank_cd(recipes_recipe.search_vector, {tsquery})', (query,),
+        output_field=FloatField()
+    ))
+
+
+def search_recipes_sqlite(queryset, words):
+    """
+    Поиск по таблице FTS5. Стемминга для русского в FTS5 нет,
+    поэтому каждое слово ищется как префикс.
+    """
+    match = ' '.join(f'"{word}"*' for word in words)
+    weights = ', '.join(map(str, FTS_WEIGHTS))
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = recipes_recipe.id',
+               f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+        select={'search_rank': f'-bm25({FTS_TABLE}, {weights})'},
+    )
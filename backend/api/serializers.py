@@ -1,18 +1,56 @@
-from django.shortcuts import get_object_or_404
+import time
+
+from django.conf import settings
+from django.db import transaction
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
-from rest_framework.fields import IntegerField, SerializerMethodField
-from rest_framework.relations import PrimaryKeyRelatedField
-from rest_framework.serializers import ModelSerializer, ReadOnlyField
+from rest_framework.fields import (IntegerField, ListField,
+                                   SerializerMethodField)
+from rest_framework.serializers import (ListSerializer, ModelSerializer,
+                                        ReadOnlyField, Serializer)
 
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 
-from recipes.models import (Ingredient, IngredientInRecipe, Recipe, Tag)
+from recipes.images import get_srcset
+from recipes.models import (Ingredient, IngredientInRecipe, IngredientPosting,
+                            Recipe, Tag)
 from users.models import Subscribe, User
+from .catalog import get_catalog
+from .fields import CatalogTagField, ChunkedBase64ImageField
+from .relations import get_context_relations
+
+
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit или None, если он не задан."""
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+class SerializeTimeMixin:
+    """
+    Время to_representation сериализатора верхнего уровня (или его
+    элементов при many=True) попадает в метрики запроса. Вложенные
+    сериализаторы отдельно не учитываются.
+    """
+
+    def to_representation(self, instance):
+        stats = getattr(self.context.get('request'), 'metrics', None)
+        root = self.parent if isinstance(self.parent, ListSerializer) else self
+        if stats is None or root.parent is not None:
+            return super().to_representation(instance)
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serialize_time = (
+                (stats.serialize_time or 0) + time.perf_counter() - start
+            )
 
 
-class TagSerializer(ModelSerializer):
+class TagSerializer(SerializeTimeMixin, ModelSerializer):
     class Meta:
         model = Tag
         fields = (
@@ -23,7 +61,7 @@ class TagSerializer(ModelSerializer):
         )
 
 
-class IngredientSerializer(ModelSerializer):
+class IngredientSerializer(SerializeTimeMixin, ModelSerializer):
     class Meta:
         model = Ingredient
         fields = (
@@ -42,7 +80,7 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         )
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(SerializeTimeMixin, UserSerializer):
     is_subscribed = SerializerMethodField(read_only=True)
 
     class Meta:
@@ -57,10 +95,9 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, author):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Subscribe.objects.filter(user=user, author=author).exists()
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
+        return author.id in get_context_relations(self.context).subscriptions
 
 
 class SubscribeSerializer(CustomUserSerializer):
@@ -89,21 +126,24 @@ class SubscribeSerializer(CustomUserSerializer):
         return data
 
     def get_recipes_count(self, author):
-        return author.recipes.count()
+        return author.recipes_count
 
     def get_recipes(self, author):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = author.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        if hasattr(author, 'limited_recipes'):
+            recipes = author.limited_recipes
+        else:
+            recipes = author.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit:
+                recipes = recipes[:limit]
         serializer = RecipeShortSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
 
 class IngredientInRecipeWriteSerializer(ModelSerializer):
     id = IntegerField(write_only=True)
-    amount = IntegerField(required=True)
+    # Верхняя граница - PositiveSmallIntegerField в базе.
+    amount = IntegerField(required=True, max_value=32767)
     name = SerializerMethodField()
     measurement_unit = SerializerMethodField()
 
@@ -131,11 +171,23 @@ class IngredientInRecipeSerializer(ModelSerializer):
         fields = ("id", "name", "measurement_unit", "amount")
 
 
-class RecipeReadSerializer(ModelSerializer):
+class ImageSrcsetMixin:
+    """Добавляет поле image_srcset с уменьшенными копиями изображения."""
+
+    def get_image_srcset(self, recipe):
+        request = self.context.get('request')
+        build_url = request.build_absolute_uri if request else None
+        variants = recipe.image_renditions.get('variants', {})
+        return get_srcset(variants, build_url)
+
+
+class RecipeReadSerializer(SerializeTimeMixin, ImageSrcsetMixin,
+                           ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(many=True)
-    image = Base64ImageField()
+    image = ChunkedBase64ImageField()
+    image_srcset = SerializerMethodField(read_only=True)
     is_favorited = SerializerMethodField(read_only=True)
     is_in_shopping_cart = SerializerMethodField(read_only=True)
 
@@ -150,27 +202,27 @@ class RecipeReadSerializer(ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_srcset',
             'text',
             'cooking_time',
         )
 
     def get_is_favorited(self, recipe):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.favorites.filter(recipe=recipe).exists()
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
+        return recipe.id in get_context_relations(self.context).favorites
 
     def get_is_in_shopping_cart(self, recipe):
-        user = self.context.get('request').user
-        return user.shopping_cart.filter(recipe=recipe).exists()
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
+        return recipe.id in get_context_relations(self.context).shopping_cart
 
 
 class RecipeWriteSerializer(ModelSerializer):
-    tags = PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                  many=True)
+    tags = CatalogTagField(queryset=Tag.objects.all(), many=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = IngredientInRecipeWriteSerializer(many=True)
-    image = Base64ImageField()
+    image = ChunkedBase64ImageField()
 
     class Meta:
         model = Recipe
@@ -190,18 +242,21 @@ class RecipeWriteSerializer(ModelSerializer):
             raise ValidationError({
                 'ingredients': 'Нужен хотя бы один ингредиент!'
             })
-        ingredients_list = []
-        for item in value:
-            ingredient = get_object_or_404(Ingredient, id=item['id'])
-            if ingredient in ingredients_list:
-                raise ValidationError({
-                    'ingredients': 'Ингридиенты не должны повторяться!'
-                })
-            if int(item['amount']) <= 0:
-                raise ValidationError({
-                    'amount': 'Количество ингредиента должно быть больше 0!'
-                })
-            ingredients_list.append(ingredient)
+        ids = [item['id'] for item in value]
+        if len(ids) > len(set(ids)):
+            raise ValidationError({
+                'ingredients': 'Ингридиенты не должны повторяться!'
+            })
+        catalog = get_catalog()
+        missing = [pk for pk in ids if catalog.get_ingredient(pk) is None]
+        if missing:
+            raise ValidationError({
+                'ingredients': f'Ингредиентов с id {missing} нет!'
+            })
+        if any(item['amount'] <= 0 for item in value):
+            raise ValidationError({
+                'amount': 'Количество ингредиента должно быть больше 0!'
+            })
         return value
 
     def validate_tags(self, value):
@@ -209,51 +264,115 @@ class RecipeWriteSerializer(ModelSerializer):
             raise ValidationError({
                 'tags': 'Нужно выбрать хотя бы один тег!'
             })
-        if len(value['tags']) > len(set(value['tags'])):
+        if len(value) > len(set(value)):
             raise ValidationError({
                 'tags': 'Теги должны быть уникальными!'
             })
         return value
 
-    def create_ingredients_amounts(self, ingredients, recipe):
-        for ingredient in ingredients:
-            ing, _ = IngredientInRecipe.objects.get_or_create(
-                ingredient=get_object_or_404(
-                    Ingredient.objects.filter(id=ingredient['id'])
-                ),
-                amount=ingredient['amount'],
-            )
-            recipe.ingredients.add(ing.id)
+    def validate(self, data):
+        """Название рецепта у автора уникально (unique_recipe_model)."""
+        name = data.get('name')
+        if name is not None:
+            author = (self.instance.author if self.instance
+                      else self.context['request'].user)
+            recipes = Recipe.objects.filter(author=author, name=name)
+            if self.instance is not None:
+                recipes = recipes.exclude(pk=self.instance.pk)
+            if recipes.exists():
+                raise ValidationError({
+                    'name': 'У вас уже есть рецепт с таким названием!'
+                })
+        return data
+
+    def get_ingredient_amount_ids(self, ingredients):
+        """
+        Id строк IngredientInRecipe для пар (ингредиент, количество).
+        Строки общие для всех рецептов: недостающие создаются одной
+        пачкой, всё остальное читается одним запросом.
+        """
+        pairs = {(item['id'], item['amount']) for item in ingredients}
+        lookup = IngredientInRecipe.objects.filter(
+            ingredient_id__in={pk for pk, _ in pairs},
+            amount__in={amount for _, amount in pairs},
+        )
 
+        def fetch_existing():
+            return {
+                (pk, amount): amount_id
+                for amount_id, pk, amount in lookup.values_list(
+                    'id', 'ingredient_id', 'amount'
+                ) if (pk, amount) in pairs
+            }
+
+        existing = fetch_existing()
+        if len(existing) < len(pairs):
+            IngredientInRecipe.objects.bulk_create(
+                [IngredientInRecipe(ingredient_id=pk, amount=amount)
+                 for pk, amount in pairs - existing.keys()],
+                ignore_conflicts=True,
+            )
+            existing = fetch_existing()
+        return set(existing.values())
+
+    def set_ingredients(self, recipe, ingredients, created=False):
+        """
+        Приводит ингредиенты рецепта к переданному набору: удаляются и
+        добавляются только изменившиеся связи. Сигналы m2m при этом не
+        отправляются, поэтому индекс по ингредиентам обновляется здесь.
+        """
+        through = Recipe.ingredients.through
+        wanted = self.get_ingredient_amount_ids(ingredients)
+        current = set() if created else set(
+            through.objects.filter(recipe=recipe).values_list(
+                'ingredientinrecipe_id', flat=True
+            )
+        )
+        if current - wanted:
+            through.objects.filter(
+                recipe=recipe, ingredientinrecipe_id__in=current - wanted
+            ).delete()
+        through.objects.bulk_create([
+            through(recipe=recipe, ingredientinrecipe_id=amount_id)
+            for amount_id in wanted - current
+        ])
+        IngredientPosting.objects.rebuild([recipe.pk])
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(**validated_data)
+        recipe = Recipe.objects.create(
+            author=self.context.get('request').user, **validated_data
+        )
         recipe.tags.set(tags)
-        self.create_ingredients_amounts(recipe=recipe,
-                                        ingredients=ingredients)
+        self.set_ingredients(recipe, ingredients, created=True)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        # instance = super().update(instance, validated_data)
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_ingredients_amounts(recipe=instance,
-                                        ingredients=ingredients)
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            self.set_ingredients(instance, ingredients)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        instance = Recipe.objects.with_related(request.user).with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         return RecipeReadSerializer(instance,
                                     context=context).data
 
 
-class RecipeShortSerializer(ModelSerializer):
-    image = Base64ImageField()
+class RecipeShortSerializer(SerializeTimeMixin, ImageSrcsetMixin,
+                            ModelSerializer):
+    image = ChunkedBase64ImageField()
+    image_srcset = SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -261,5 +380,41 @@ class RecipeShortSerializer(ModelSerializer):
             'id',
             'name',
             'image',
+            'image_srcset',
             'cooking_time'
         )
+
+
+class BulkIdsSerializer(Serializer):
+    ids = ListField(
+        child=IntegerField(min_value=1, max_value=2 ** 63 - 1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+class RecipeMatchSerializer(RecipeReadSerializer):
+    matched = IntegerField(read_only=True)
+    missing = IntegerField(read_only=True)
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + ('matched', 'missing')
+
+
+class WhatToCookSerializer(Serializer):
+    ingredients = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.WHAT_TO_COOK_MAX_INGREDIENTS
+    )
+    limit = IntegerField(
+        min_value=1,
+        max_value=settings.WHAT_TO_COOK_MAX_LIMIT,
+        default=settings.WHAT_TO_COOK_LIMIT
+    )
+
+    def validate_ingredients(self, ingredients):
+        return list(dict.fromkeys(ingredients))
@@ -0,0 +1,120 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import Subscribe
+from .authentication import invalidate_token
+from .catalog import bump_catalog_version
+from .relations import invalidate_user_relations
+from .response_cache import bump_generations, invalidate_recipe
+
+User = get_user_model()
+
+# Поля пользователя, которые видны в ответе с рецептом.
+AUTHOR_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def catalog_changed(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+def get_tag_ids(recipe_id):
+    return list(Recipe.tags.through.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('tag_id', flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(lambda: invalidate_recipe(
+        instance.pk, instance.author_id, get_tag_ids(instance.pk)
+    ))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    tag_ids = get_tag_ids(instance.pk)
+    transaction.on_commit(lambda: invalidate_recipe(
+        instance.pk, instance.author_id, tag_ids
+    ))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """Сбрасывает ленты и по новым, и по снятым тегам."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        recipes = instance.recipes.all()
+        if pk_set is not None:
+            recipes = Recipe.objects.filter(pk__in=pk_set)
+        changes = [(recipe_id, author_id, [instance.pk])
+                   for recipe_id, author_id
+                   in recipes.values_list('id', 'author_id')]
+    else:
+        tag_ids = pk_set if pk_set is not None else get_tag_ids(instance.pk)
+        changes = [(instance.pk, instance.author_id, list(tag_ids))]
+    transaction.on_commit(lambda: [
+        invalidate_recipe(*change) for change in changes
+    ])
+
+
+@receiver(post_save, sender=User)
+def author_saved(sender, instance, created, update_fields=None,
+                 raw=False, **kwargs):
+    """
+    Данные автора входят во все его рецепты в лентах и карточках,
+    поэтому у рецептов обновляется время изменения (ETag карточки).
+    """
+    if created or raw or (update_fields is not None
+                          and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=timezone.now())
+    scopes = {'all', f'author:{instance.pk}'}
+    recipes = Recipe.objects.filter(author=instance)
+    for recipe_id, tag_id in recipes.values_list('id', 'tags'):
+        scopes.add(f'recipe:{recipe_id}')
+        if tag_id is not None:
+            scopes.add(f'tag:{tag_id}')
+    transaction.on_commit(lambda: bump_generations(scopes))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def counters_changed(sender, **kwargs):
+    """Ленты с сортировкой по популярности."""
+    transaction.on_commit(lambda: bump_generations(['counters']))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscribe)
+def user_relations_changed(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: invalidate_user_relations(instance.user_id)
+    )
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_token(instance.key))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, **kwargs):
+    """Пользователь в кеше токенов должен совпадать с базой."""
+    if created or raw:
+        return
+    for key in Token.objects.filter(user=instance).values_list(
+            'key', flat=True):
+        transaction.on_commit(lambda key=key: invalidate_token(key))
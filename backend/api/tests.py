@@ -0,0 +1,279 @@
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.serializers import RecipeWriteSerializer
+from api.units import merge_ingredients
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Subscribe
+
+User = get_user_model()
+
+PAGE_SIZES = (1, 5, 20)
+# Тесты не трогают настоящие кеши: у каждого алиаса свой LocMemCache.
+TEST_CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'test-{alias}',
+    }
+    for alias in settings.CACHES
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeListQueriesTest(TestCase):
+    """Число запросов ленты не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@example.com')
+        authors = [
+            User.objects.create(username=f'author{index}',
+                                email=f'author{index}@example.com')
+            for index in range(3)
+        ]
+        tags = [
+            Tag.objects.create(name=f'tag{index}', slug=f'tag{index}',
+                               color=f'#00000{index}')
+            for index in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'ingredient{index}',
+                                      measurement_unit='г')
+            for index in range(5)
+        ]
+        for index in range(max(PAGE_SIZES)):
+            recipe = Recipe.objects.create(
+                author=authors[index % len(authors)], name=f'recipe{index}',
+                text='text', cooking_time=10, image='recipes/images/x.png'
+            )
+            recipe.tags.set(tags[:1 + index % len(tags)])
+            recipe.ingredients.set([
+                IngredientInRecipe.objects.get_or_create(
+                    ingredient=ingredient, amount=index + 1
+                )[0]
+                for ingredient in ingredients[:2 + index % 3]
+            ])
+            if index % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if index % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Subscribe.objects.create(user=cls.user, author=authors[0])
+
+    def get_list(self, client, limit, **params):
+        # Ответ не должен браться из кеша ответов.
+        for cache in caches.all():
+            cache.clear()
+        response = client.get('/api/recipes/', {'limit': limit, **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']),
+                         min(limit, response.data['count']))
+        return response
+
+    def assert_constant_queries(self, client, **params):
+        # Первый запрос создаёт версию каталога и загружает каталог.
+        self.get_list(client, 1, **params)
+        with CaptureQueriesContext(connection) as context:
+            self.get_list(client, 2, **params)
+        for limit in PAGE_SIZES:
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(len(context)):
+                    self.get_list(client, limit, **params)
+
+    def test_anonymous(self):
+        self.assert_constant_queries(APIClient())
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assert_constant_queries(client)
+
+    def test_authenticated_with_user_filters(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assert_constant_queries(client, is_favorited=1,
+                                     is_in_shopping_cart=1)
+
+    def test_cursor_pages(self):
+        client = APIClient()
+        ids, url = [], '/api/recipes/?cursor=&limit=3'
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True)))
+
+    def test_cursor_with_ordering(self):
+        for params in ({'ordering': 'pub_date'}, {'search': 'recipe'}):
+            with self.subTest(**params):
+                response = APIClient().get(
+                    '/api/recipes/', {'cursor': '', **params}
+                )
+                self.assertEqual(response.status_code, 400)
+
+
+# Картинка 1x1 в формате PNG.
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=='
+)
+
+
+@override_settings(CACHES=TEST_CACHES, MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeWriteValidationTest(TestCase):
+    """Ограничения базы проверяются сериализатором, а не дают 500."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='author',
+                                       email='author@example.com')
+        cls.tag = Tag.objects.create(name='tag', slug='tag', color='#000000')
+        cls.ingredient = Ingredient.objects.create(name='ingredient',
+                                                   measurement_unit='г')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_data(self, name='recipe', amount=10):
+        return {
+            'name': name, 'text': 'text', 'cooking_time': 10,
+            'image': IMAGE, 'tags': [self.tag.pk],
+            'ingredients': [{'id': self.ingredient.pk, 'amount': amount}],
+        }
+
+    def test_duplicate_name(self):
+        response = self.client.post('/api/recipes/', self.get_data(),
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/recipes/', self.get_data(),
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.data)
+
+    def test_update_keeps_own_name(self):
+        recipe = Recipe.objects.create(author=self.user, name='recipe',
+                                       text='text', cooking_time=10)
+        serializer = RecipeWriteSerializer(
+            recipe, data={'name': 'recipe'}, partial=True,
+            context={'request': None}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_amount_limit(self):
+        response = self.client.post('/api/recipes/',
+                                    self.get_data(amount=32768),
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BulkRelationsTest(TestCase):
+    """Статусы массовых операций и изменения счётчиков."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@example.com')
+        cls.author = User.objects.create(username='author',
+                                         email='author@example.com')
+        cls.recipes = [
+            Recipe.objects.create(author=cls.author, name=f'recipe{index}',
+                                  text='text', cooking_time=10)
+            for index in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, method, url, ids):
+        response = getattr(self.client, method)(url, {'ids': ids},
+                                                format='json')
+        self.assertEqual(response.status_code, 200)
+        return [item['status'] for item in response.data['results']]
+
+    def get_counts(self, field):
+        return list(Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in self.recipes]
+        ).order_by('pk').values_list(field, flat=True))
+
+    def assert_recipe_bulk(self, url, field):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        missing = third + 100
+        self.assertEqual(
+            self.send('post', url, [first, second, missing]),
+            ['added', 'added', 'not_found']
+        )
+        self.assertEqual(self.get_counts(field), [1, 1, 0])
+        self.assertEqual(self.send('post', url, [first, third]),
+                         ['already_added', 'added'])
+        self.assertEqual(self.get_counts(field), [1, 1, 1])
+        self.assertEqual(self.send('delete', url, [first, second]),
+                         ['removed', 'removed'])
+        self.assertEqual(self.send('delete', url, [first, missing]),
+                         ['not_added', 'not_added'])
+        self.assertEqual(self.get_counts(field), [0, 0, 1])
+
+    def test_recipes(self):
+        for url, field in (('/api/recipes/favorite/', 'favorites_count'),
+                           ('/api/recipes/shopping_cart/', 'cart_count')):
+            for returning in (True, False):
+                with self.subTest(url=url, returning=returning):
+                    with mock.patch('api.bulk.supports_returning',
+                                    return_value=returning):
+                        self.assert_recipe_bulk(url, field)
+                    self.send('delete', url,
+                              [recipe.pk for recipe in self.recipes])
+
+    def test_subscribe(self):
+        url = '/api/users/subscribe/'
+        self.assertEqual(
+            self.send('post', url, [self.author.pk, self.user.pk]),
+            ['added', 'forbidden']
+        )
+        self.assertEqual(self.send('post', url, [self.author.pk]),
+                         ['already_added'])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 1)
+        self.assertEqual(self.send('delete', url, [self.author.pk]),
+                         ['removed'])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 0)
+
+
+class MergeIngredientsTest(SimpleTestCase):
+    """Сведение списка покупок по базовым единицам."""
+
+    def test_merge(self):
+        rows = [
+            ('мука', 200, 'г'),
+            ('мука', 1, 'кг'),
+            ('молоко', 2, 'ст. л.'),
+            ('молоко', 1, 'ст. л.'),
+            ('соль', 1, 'по вкусу'),
+            ('сахар', 1, 'стакан'),
+            ('сахар', 50, 'г'),
+            ('яйца', 3, 'шт'),
+            ('яйца', 2, 'штука'),
+        ]
+        self.assertEqual(merge_ingredients(rows), [
+            ('молоко', 3, 'ст. л.'),
+            ('мука', 1.2, 'кг'),
+            ('сахар', 50, 'г'),
+            ('сахар', 1, 'стакан'),
+            ('соль', 1, 'по вкусу'),
+            ('яйца', 5, 'шт.'),
+        ])
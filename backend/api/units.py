@@ -0,0 +1,78 @@
+import re
+from decimal import Decimal
+
+# Единица измерения -> (базовая единица, сколько в ней базовых).
+# Ключи в нижнем регистре, без пробелов и точек: 'ст. л.' -> 'стл'.
+UNITS = {
+    'мг': ('г', Decimal('0.001')),
+    'г': ('г', 1),
+    'гр': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'чл': ('мл', 5),
+    'стл': ('мл', 15),
+    'стакан': ('мл', 200),
+    'капля': ('мл', Decimal('0.05')),
+    'шт': ('шт.', 1),
+    'штука': ('шт.', 1),
+}
+# Базовая единица -> крупная единица и сколько в ней базовых.
+LARGER_UNITS = {
+    'г': ('кг', 1000),
+    'мл': ('л', 1000),
+}
+UNIT_SEPARATORS = re.compile(r'[\s.]+')
+
+
+def get_base_unit(unit):
+    """
+    Базовая единица и множитель. Единицы не из таблицы
+    ('по вкусу', 'щепотка') остаются сами себе базовыми.
+    """
+    return UNITS.get(UNIT_SEPARATORS.sub('', unit.lower()), (unit, 1))
+
+
+def to_number(value):
+    """Целое, если дробной части нет, иначе до трёх знаков."""
+    if value == value.to_integral_value():
+        return int(value)
+    return float(round(value, 3))
+
+
+def format_line(name, base, total, units):
+    """
+    Строка списка в удобной единице: если у продукта одна единица
+    и она не базовая ('ст. л.', 'кг'), она и остаётся, иначе
+    количество в базовой единице или в крупной, если набралось
+    больше одной крупной.
+    """
+    if len(units) == 1 and units != {base}:
+        unit = next(iter(units))
+        return name, to_number(total / get_base_unit(unit)[1]), unit
+    larger, size = LARGER_UNITS.get(base, (base, 1))
+    if total >= size:
+        return name, to_number(total / size), larger
+    return name, to_number(total), base
+
+
+def merge_ingredients(rows):
+    """
+    Сводит строки (название, количество, единица) в одну строку на
+    продукт и базовую единицу: 200 г и 1 кг муки станут 1.2 кг.
+    Количества переводятся в базовую единицу и суммируются за один
+    проход. Массу с объёмом без плотности не сложить, поэтому они
+    остаются разными строками.
+    """
+    totals = {}
+    for name, amount, unit in rows:
+        base, factor = get_base_unit(unit)
+        line = totals.get((name, base))
+        if line is None:
+            line = totals[name, base] = [Decimal(0), set()]
+        line[0] += amount * Decimal(factor)
+        line[1].add(unit)
+    return [
+        format_line(name, base, total, units)
+        for (name, base), (total, units) in sorted(totals.items())
+    ]
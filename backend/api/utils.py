@@ -1,17 +1,230 @@
-from django.db.models import F, Sum
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import BooleanField
+from weasyprint import HTML
 
 from recipes.models import IngredientInRecipe
+from .units import merge_ingredients
+
+_pdf_executor = None
 
 
 def get_list_ingredients(user):
     """
-    Cуммирование позиций из разных рецептов.
+    Список покупок: база суммирует количества по ингредиентам,
+    затем одинаковые продукты в разных единицах сводятся в одну
+    строку (название, количество, единица).
     """
-
-    ingredients = IngredientInRecipe.objects.filter(
-        recipe__shopping_cart__user=user).values(
-        name=F('ingredient__name'),
-        measurement_unit=F('ingredient__measurement_unit')
+    rows = IngredientInRecipe.objects.filter(
+        recipes__shopping_cart__user=user
+    ).values_list(
+        'ingredient__name', 'ingredient__measurement_unit'
     ).annotate(amount=Sum('amount')).values_list(
-        'ingredient__name', 'amount', 'ingredient__measurement_unit')
-    return ingredients
+        'ingredient__name', 'amount', 'ingredient__measurement_unit'
+    ).order_by()
+    return merge_ingredients(rows.iterator())
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def stream_txt(ingredients):
+    for name, amount, measurement_unit in ingredients:
+        yield f'{name} ({measurement_unit}) — {amount}\n'
+
+
+def stream_md(ingredients):
+    yield '# Список покупок\n\n'
+    for name, amount, measurement_unit in ingredients:
+        yield f'- [ ] {name} ({measurement_unit}) — {amount}\n'
+
+
+def stream_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for row in ingredients:
+        yield writer.writerow(row)
+
+
+def stream_json(ingredients):
+    separator = '['
+    for name, amount, measurement_unit in ingredients:
+        yield separator + json.dumps({
+            'name': name,
+            'amount': amount,
+            'measurement_unit': measurement_unit,
+        }, ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+SHOPPING_LIST_STREAMS = {
+    'txt': stream_txt,
+    'md': stream_md,
+    'csv': stream_csv,
+    'json': stream_json,
+}
+
+
+def stream_shopping_list(user, export_format):
+    """
+    Построчная выгрузка списка покупок без сборки всего документа
+    в памяти: в памяти только сведённые строки, не больше числа
+    продуктов в каталоге.
+    """
+    return SHOPPING_LIST_STREAMS[export_format](get_list_ingredients(user))
+
+
+def get_cart_digest(ingredients):
+    """
+    Хэш содержимого списка покупок, по которому кэшируется pdf.
+    """
+    digest = hashlib.sha256()
+    for name, amount, measurement_unit in ingredients:
+        digest.update(f'{name}\t{amount}\t{measurement_unit}\n'.encode())
+    return digest.hexdigest()
+
+
+def get_pdf_path(user_id, digest):
+    """
+    Pdf лежат в каталоге пользователя: по хэшу чужой корзины
+    свой pdf не получить.
+    """
+    return os.path.join(
+        settings.SHOPPING_LIST_CACHE_DIR, str(user_id), f'{digest}.pdf'
+    )
+
+
+def remove_expired_files(directory, expired):
+    """Удаляет файлы старше expired и сам каталог, если он опустел."""
+    for entry in os.scandir(directory):
+        with suppress(OSError):
+            if entry.stat().st_mtime < expired:
+                os.remove(entry.path)
+    with suppress(OSError):
+        os.rmdir(directory)
+
+
+def remove_expired_pdfs():
+    """
+    Удаляет pdf старше SHOPPING_LIST_PDF_TTL. Каталог обходится
+    не чаще раза в SHOPPING_LIST_CLEANUP_INTERVAL на все воркеры:
+    время последнего обхода - это mtime файла-метки.
+    """
+    root = settings.SHOPPING_LIST_CACHE_DIR
+    stamp = os.path.join(root, '.cleanup')
+    now = time.time()
+    with suppress(OSError):
+        if (now - os.path.getmtime(stamp)
+                < settings.SHOPPING_LIST_CLEANUP_INTERVAL):
+            return
+    os.makedirs(root, exist_ok=True)
+    open(stamp, 'w').close()
+    expired = now - settings.SHOPPING_LIST_PDF_TTL
+    for entry in os.scandir(root):
+        if entry.is_dir():
+            remove_expired_files(entry.path, expired)
+
+
+def write_pdf(html, path):
+    """
+    Рендерит html в pdf. Файл сначала пишется во временный,
+    чтобы читатели никогда не увидели недописанный pdf.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    HTML(string=html).write_pdf(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def render_pdf(html, user_id, digest):
+    """Синхронный рендеринг pdf в кэш."""
+    remove_expired_pdfs()
+    path = get_pdf_path(user_id, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_pdf(html, path)
+
+
+def render_pdf_async(html, user_id, digest):
+    """
+    Ставит рендеринг pdf в пул процессов. Пока pdf готовится,
+    рядом с ним лежит файл-маркер, видимый всем воркерам.
+    """
+    global _pdf_executor
+    if is_pdf_pending(user_id, digest):
+        return
+    remove_expired_pdfs()
+    path = get_pdf_path(user_id, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pending_path = path + '.pending'
+    open(pending_path, 'w').close()
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(
+            max_workers=settings.SHOPPING_LIST_PDF_WORKERS
+        )
+    future = _pdf_executor.submit(write_pdf, html, path)
+
+    def remove_pending(future):
+        with suppress(OSError):
+            os.remove(pending_path)
+
+    future.add_done_callback(remove_pending)
+
+
+def is_pdf_pending(user_id, digest):
+    """
+    Рендеринг считается идущим, пока маркер не старше таймаута:
+    маркер упавшего воркера не блокирует повторную попытку.
+    """
+    pending_path = get_pdf_path(user_id, digest) + '.pending'
+    try:
+        started = os.path.getmtime(pending_path)
+    except OSError:
+        return False
+    return time.time() - started < settings.SHOPPING_LIST_PDF_TIMEOUT
+
+
+def get_bool_param(request, name):
+    """Параметр запроса 1/0 или true/false; другое значение - 400."""
+    value = request.query_params.get(name)
+    if value is None:
+        return False
+    try:
+        return BooleanField().to_internal_value(value)
+    except ValidationError as error:
+        raise ValidationError({name: error.detail})
+
+
+def conditional_response(request, build_response, etag=None,
+                         last_modified=None):
+    """
+    Ответ на условный GET: 304, если у клиента актуальная версия,
+    иначе результат build_response(). last_modified - unix-время.
+    """
+    if etag is not None:
+        etag = quote_etag(etag)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = build_response()
+    if response.status_code in (200, 304):
+        if etag is not None:
+            response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -1,57 +1,226 @@
-from django.http import HttpResponse
+import os
+
+from django.conf import settings
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.template.loader import render_to_string
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
-from weasyprint import HTML
 
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+from backend.db import use_primary
+from recipes.models import (Favorite, Ingredient, IngredientPosting, Recipe,
                             ShoppingCart, Tag)
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .bulk import RECIPE_ERRORS, bulk_response
+from .catalog import get_catalog, get_catalog_modified, get_catalog_version
+from .filters import RecipeFilter
+from .pagination import RecipePagination
 from .permissions import IsAdminOrReadOnly, IsAdminAuthorOrReadOnly
-from .serializers import (IngredientSerializer, RecipeReadSerializer,
-                          RecipeShortSerializer, RecipeWriteSerializer,
-                          TagSerializer)
+from .relations import EMPTY_RELATIONS, get_user_relations, overlay_recipe
+from .renderers import SHOPPING_LIST_RENDERERS
+from .response_cache import (cache_response, get_cached_response,
+                             get_detail_cache_key, get_list_cache_key)
+from .serializers import (IngredientSerializer, RecipeMatchSerializer,
+                          RecipeReadSerializer, RecipeShortSerializer,
+                          RecipeWriteSerializer, TagSerializer,
+                          WhatToCookSerializer)
+from .utils import (conditional_response, get_bool_param, get_cart_digest,
+                    get_list_ingredients, get_pdf_path, is_pdf_pending,
+                    render_pdf, render_pdf_async, stream_shopping_list)
+
+
+class CatalogConditionalMixin:
+    """
+    ETag и Last-Modified для данных каталога берутся из его версии,
+    поэтому 304 отдаётся без загрузки каталога и сериализации.
+    """
 
-from .utils import get_list_ingredients
+    def finalize_catalog_response(self, request, build_response):
+        version = get_catalog_version()
+        return conditional_response(
+            request, build_response,
+            etag=version, last_modified=get_catalog_modified(version)
+        )
 
 
-class TagViewSet(ReadOnlyModelViewSet):
-    """Вьюсет для модели тега."""
+class TagViewSet(CatalogConditionalMixin, ReadOnlyModelViewSet):
+    """Вьюсет для модели тега. Данные берутся из каталога в памяти."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAdminOrReadOnly,)
     pagination_class = None
 
+    def list(self, request):
+        return self.finalize_catalog_response(request, self.__list)
+
+    def retrieve(self, request, pk=None):
+        return self.finalize_catalog_response(
+            request, lambda: self.__retrieve(pk)
+        )
+
+    def __list(self):
+        catalog = get_catalog()
+        return Response(catalog.memoize('tags', lambda: list(
+            self.get_serializer(catalog.tags, many=True).data
+        )))
+
+    def __retrieve(self, pk):
+        tag = get_catalog().get_tag(pk)
+        if tag is None:
+            raise Http404
+        return Response(self.get_serializer(tag).data)
 
-class IngredientViewSet(ReadOnlyModelViewSet):
-    """Вьюсет для модели ингридиента."""
+
+class IngredientViewSet(CatalogConditionalMixin, ReadOnlyModelViewSet):
+    """
+    Вьюсет для модели ингридиента. Данные берутся из каталога в памяти.
+    Параметр name включает поиск: сначала совпадения по началу названия,
+    потом по подстроке, потом с опечатками, не больше
+    INGREDIENT_SEARCH_LIMIT.
+    """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAdminOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request):
+        return self.finalize_catalog_response(
+            request, lambda: self.__list(request.query_params.get('name'))
+        )
+
+    def retrieve(self, request, pk=None):
+        return self.finalize_catalog_response(
+            request, lambda: self.__retrieve(pk)
+        )
+
+    def __list(self, name):
+        catalog = get_catalog()
+        if name:
+            ingredients = catalog.search_ingredients(
+                name, settings.INGREDIENT_SEARCH_LIMIT
+            )
+            return Response(self.get_serializer(ingredients, many=True).data)
+        return Response(catalog.memoize('ingredients', lambda: list(
+            self.get_serializer(catalog.ingredient_list(), many=True).data
+        )))
+
+    def __retrieve(self, pk):
+        ingredient = get_catalog().get_ingredient(pk)
+        if ingredient is None:
+            raise Http404
+        return Response(self.get_serializer(ingredient).data)
+
 
 class RecipeViewSet(ModelViewSet):
     """Вьюсет для модели рецепта."""
     queryset = Recipe.objects.all()
     permission_classes = (IsAdminAuthorOrReadOnly,)
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    shared_response = False
+
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.with_related()
+        return super().get_queryset()
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
         return RecipeWriteSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.shared_response:
+            context['relations'] = EMPTY_RELATIONS
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """
+        Лента. Общая для всех часть ответа берётся из кеша ответов,
+        флаги пользователя накладываются поверх. Кеш заполняется
+        с основной базы: ответ с отстающей реплики жил бы в нём до
+        истечения срока.
+        """
+        key = get_list_cache_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+        data = get_cached_response(key)
+        if data is None:
+            self.shared_response = True
+            with use_primary():
+                data = super().list(request, *args, **kwargs).data
+            cache_response(key, data)
+        relations = get_user_relations(request)
+        for recipe in data['results']:
+            overlay_recipe(recipe, relations)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Рецепт. Общая часть ответа вместе с временем изменения берётся
+        из кеша ответов, флаги пользователя накладываются поверх.
+        ETag строится из времени изменения, версии каталога (теги
+        и ингредиенты в ответе) и флагов; изменение автора обновляет
+        время изменения его рецептов. Last-Modified отдаётся только
+        анонимам: для остальных ответ меняется и без изменения рецепта,
+        например при подписке.
+        """
+        pk = kwargs['pk']
+        key = get_detail_cache_key(request, pk)
+        cached = get_cached_response(key)
+        if cached is None:
+            with use_primary():
+                cached = self.__get_version(pk)
+        if cached is None:
+            return super().retrieve(request, *args, **kwargs)
+        data, updated_at, author_id = cached
+        relations = get_user_relations(request)
+        flags = relations.get_flags(int(pk), author_id)
+        timestamp = updated_at.timestamp()
+        catalog_version = get_catalog_version()
+        etag = '{}-{}-{}-{}'.format(
+            pk, int(timestamp * 1000000), catalog_version,
+            ''.join(str(int(flag)) for flag in flags)
+        )
+        last_modified = None if request.user.is_authenticated else max(
+            int(timestamp), get_catalog_modified(catalog_version) or 0
+        )
+
+        def build_response():
+            body = data
+            if body is None:
+                self.shared_response = True
+                with use_primary():
+                    body = super(RecipeViewSet, self).retrieve(
+                        request, *args, **kwargs
+                    ).data
+                cache_response(key, (body, updated_at, author_id))
+            return Response(overlay_recipe(body, relations))
+
+        response = conditional_response(
+            request, build_response, etag, last_modified
+        )
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def __get_version(self, pk):
+        """Время изменения и автор рецепта без его загрузки."""
+        try:
+            version = Recipe.objects.filter(pk=pk).values_list(
+                'updated_at', 'author_id'
+            ).first()
+        except ValueError:
+            return None
+        return version and (None, *version)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -76,51 +245,159 @@ class RecipeViewSet(ModelViewSet):
         else:
             return self.__delete_from(ShoppingCart, request.user, pk)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite',
+        url_name='favorite-bulk'
+    )
+    def favorite_bulk(self, request):
+        """Метод для добавления/удаления нескольких рецептов в избранное."""
+        return bulk_response(request, Favorite, RECIPE_ERRORS)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk'
+    )
+    def shopping_cart_bulk(self, request):
+        """Метод для добавления/удаления нескольких рецептов в покупки."""
+        return bulk_response(request, ShoppingCart, RECIPE_ERRORS)
+
+    def __get_recipe_id(self, pk):
+        """Id рецепта из адреса; 404, если это не число или не bigint."""
+        try:
+            recipe_id = int(pk)
+        except ValueError:
+            raise Http404
+        if not 0 < recipe_id < 2 ** 63:
+            raise Http404
+        return recipe_id
+
     def __add_to(self, model, user, pk):
         """Метод для добавления."""
-        if model.objects.filter(user=user, recipe__id=pk).exists():
+        recipe = get_object_or_404(Recipe, id=self.__get_recipe_id(pk))
+        if not model.objects.add(user, recipe.id):
             return Response({'errors': 'Рецепт уже добавлен!'},
                             status=status.HTTP_400_BAD_REQUEST)
-        recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
         serializer = RecipeShortSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def __delete_from(self, model, user, pk):
         """Метод для удаления."""
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
+        if model.objects.remove(user, self.__get_recipe_id(pk)):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'errors': 'Рецепт уже удален!'},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False)
+    def what_to_cook(self, request):
+        """
+        Рецепты из имеющихся ингредиентов: параметр ingredients (id,
+        можно повторять или перечислить через запятую) и limit.
+        Сначала рецепты, где не хватает меньше всего ингредиентов.
+        """
+        query = request.query_params
+        data = {'ingredients': [
+            part for value in query.getlist('ingredients')
+            for part in value.split(',') if part
+        ]}
+        if 'limit' in query:
+            data['limit'] = query['limit']
+        serializer = WhatToCookSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        matches = IngredientPosting.objects.top_recipes(
+            serializer.validated_data['ingredients'],
+            serializer.validated_data['limit']
+        )
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, *_ in matches]
+        )
+        results = []
+        for recipe_id, matched, missing in matches:
+            recipe = recipes[recipe_id]
+            recipe.matched, recipe.missing = matched, missing
+            results.append(recipe)
+        return Response(RecipeMatchSerializer(
+            results, many=True, context=self.get_serializer_context()
+        ).data)
+
     @action(
         detail=False,
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS
     )
     def download_shopping_cart(self, request):
-        """Метод для скачивания списка покупок."""
-<<<<<<< HEAD
-        ingredients = get_list_ingredients(request.user)
-=======
-        user = request.user
-        if not user.shopping_cart.exists():
-            return Response(status=HTTP_400_BAD_REQUEST)
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            amount=Sum('amount')
-        ).order_by('ingredient__name')
->>>>>>> 4a73bcf254966e3a7bc08182277b3d398a41f179
-        html_template = render_to_string('recipes/pdf_template.html',
-                                         {'ingredients': ingredients})
-        html = HTML(string=html_template)
-        result = html.write_pdf()
-        response = HttpResponse(result, content_type='application/pdf;')
-        response['Content-Disposition'] = 'inline; filename=shopping_list.pdf'
-        response['Content-Transfer-Encoding'] = 'binary'
-        return response
+        """
+        Метод для скачивания списка покупок.
+        Формат выбирается параметром format (pdf, txt, csv, json, md)
+        или заголовком Accept, по умолчанию pdf.
+        С параметром async=1 pdf готовится в фоне, а в ответ приходит
+        ссылка, по которой его можно забрать.
+        """
+        export_format = request.accepted_renderer.format
+        if export_format != 'pdf':
+            if not request.user.shopping_cart.exists():
+                return self.__empty_cart_response()
+            response = StreamingHttpResponse(
+                stream_shopping_list(request.user, export_format),
+                content_type=request.accepted_renderer.media_type
+                + '; charset=utf-8'
+            )
+            response['Content-Disposition'] = (
+                f'inline; filename=shopping_list.{export_format}'
+            )
+            return response
+        run_async = get_bool_param(request, 'async')
+        ingredients = list(get_list_ingredients(request.user))
+        if not ingredients:
+            return self.__empty_cart_response()
+        user_id, digest = request.user.pk, get_cart_digest(ingredients)
+        if os.path.exists(get_pdf_path(user_id, digest)):
+            return self.__pdf_response(user_id, digest)
+        html = render_to_string('recipes/pdf_template.html',
+                                {'ingredients': ingredients})
+        if run_async:
+            render_pdf_async(html, user_id, digest)
+            return self.__pdf_pending_response(request, digest)
+        render_pdf(html, user_id, digest)
+        return self.__pdf_response(user_id, digest)
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        url_path=r'download_shopping_cart/(?P<digest>[0-9a-f]{64})',
+        url_name='shopping-list-pdf'
+    )
+    def shopping_list_pdf(self, request, digest):
+        """
+        Метод для получения pdf, подготовленного в фоне.
+        Отдаются только pdf текущего пользователя.
+        """
+        user_id = request.user.pk
+        if os.path.exists(get_pdf_path(user_id, digest)):
+            return self.__pdf_response(user_id, digest)
+        if is_pdf_pending(user_id, digest):
+            return self.__pdf_pending_response(request, digest)
+        return Response({'errors': 'Список покупок не найден!'},
+                        status=status.HTTP_404_NOT_FOUND)
+
+    def __empty_cart_response(self):
+        return Response({'errors': 'Список покупок пуст!'},
+                        status=status.HTTP_400_BAD_REQUEST,
+                        content_type='application/json')
+
+    def __pdf_response(self, user_id, digest):
+        return FileResponse(open(get_pdf_path(user_id, digest), 'rb'),
+                            filename='shopping_list.pdf',
+                            content_type='application/pdf')
+
+    def __pdf_pending_response(self, request, digest):
+        url = reverse('api:recipe-shopping-list-pdf', args=(digest,))
+        return Response({'status': 'Список покупок готовится',
+                         'url': request.build_absolute_uri(url)},
+                        status=status.HTTP_202_ACCEPTED,
+                        content_type='application/json')
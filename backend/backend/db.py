@@ -0,0 +1,164 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PRIMARY_PIN_COOKIE = 'primary_pin'
+PRIMARY_PIN_SALT = 'backend.db.primary_pin'
+PRIMARY_PIN_KEY = 'primary_pin:{}'
+
+# Реплика, с которой читает текущий запрос. Вне запросов (команды,
+# shell, фоновые задачи) чтение идёт с основной базы.
+read_alias = ContextVar('read_alias', default=None)
+
+
+@receiver(connection_created)
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma in settings.SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {pragma}')
+
+
+@receiver(connection_created)
+def install_health_check(sender, connection, **kwargs):
+    """
+    Аналог CONN_HEALTH_CHECKS из Django 4.1: постоянное соединение,
+    разорванное базой или pgbouncer, проверяется при первом
+    использовании в запросе и закрывается, а Django откроет новое,
+    вместо ошибки в середине запроса. Соединения, которые запрос не
+    трогает (например, реплики в запросе с записью), не проверяются.
+    """
+    if not settings.DB_HEALTH_CHECKS or 'ensure_connection' in vars(
+        connection
+    ):
+        return
+    ensure_connection = connection.ensure_connection
+
+    def ensure_healthy_connection():
+        if not getattr(connection, 'health_check_done', True):
+            connection.health_check_done = True
+            if (connection.connection is not None
+                    and not connection.in_atomic_block
+                    and not connection.is_usable()):
+                connection.close()
+        ensure_connection()
+
+    connection.ensure_connection = ensure_healthy_connection
+
+
+@receiver(request_started)
+def reset_health_checks(**kwargs):
+    """Каждое соединение проверяется заново в следующем запросе."""
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        connection.health_check_done = False
+
+
+@contextmanager
+def use_primary():
+    """
+    Чтение с основной базы. Нужно там, где отставшая реплика
+    недопустима: каталог в памяти процесса и проверка токена.
+    """
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Запись всегда в основную базу, чтение - с реплики, выбранной
+    ReplicaMiddleware для запроса, если нет открытой транзакции.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def get_pin_key(request):
+    """
+    Ключ закрепления в общем кеше по хешу учётных данных: токена из
+    Authorization или cookie сессии. Пользователь запроса до вьюсета
+    ещё не известен, а учётные данные одинаковы при записи и чтении.
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') or (
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    return PRIMARY_PIN_KEY.format(
+        hashlib.sha256(credentials.encode()).hexdigest()
+    )
+
+
+def is_pinned(request):
+    """Клиент недавно писал и должен читать с основной базы."""
+    if request.get_signed_cookie(
+        PRIMARY_PIN_COOKIE, default=None, salt=PRIMARY_PIN_SALT,
+        max_age=settings.REPLICA_STICKY_SECONDS
+    ) is not None:
+        return True
+    key = get_pin_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+def pin_to_primary(request, response):
+    """Закрепляет клиента за основной базой после записи."""
+    key = get_pin_key(request)
+    if key is not None:
+        cache.set(key, 1, settings.REPLICA_STICKY_SECONDS)
+    response.set_signed_cookie(
+        PRIMARY_PIN_COOKIE, '1', salt=PRIMARY_PIN_SALT,
+        max_age=settings.REPLICA_STICKY_SECONDS,
+        secure=request.is_secure(), httponly=True, samesite='Lax'
+    )
+
+
+class ReplicaMiddleware:
+    """
+    Безопасный запрос целиком читает с одной случайной реплики.
+    После запроса с записью клиент REPLICA_STICKY_SECONDS секунд
+    читает с основной базы, чтобы сразу видеть свои изменения.
+    Закрепление хранится в общем кеше по учётным данным - для клиентов
+    с токеном, которые не хранят cookie, - и в подписанной cookie
+    для анонимов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        safe = request.method in ('GET', 'HEAD', 'OPTIONS')
+        alias = None
+        if safe and settings.REPLICA_DATABASES and not is_pinned(request):
+            alias = random.choice(settings.REPLICA_DATABASES)
+        token = read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        if (not safe and settings.REPLICA_DATABASES
+                and response.status_code < 400):
+            pin_to_primary(request, response)
+        return response
@@ -0,0 +1,249 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LABELS = ('view', 'action', 'method', 'status')
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+PLACEHOLDER_LISTS = re.compile(r'\(\?(?:\s*,\s*\?)*\)')
+SPACES = re.compile(r'\s+')
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n'
+    )
+
+
+def format_labels(names, values):
+    return ','.join(
+        f'{name}="{escape(value)}"' for name, value in zip(names, values)
+    )
+
+
+class Histogram:
+    """
+    Гистограмма в формате Prometheus. Значения хранятся в памяти
+    процесса: при нескольких воркерах gunicorn каждый отдаёт свои.
+    """
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * len(self.buckets) + [0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in sorted(self.series.items()):
+            prefix = format_labels(LABELS, labels)
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{{{prefix},le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{prefix},le="+Inf"}} {series[-1]}'
+            yield f'{self.name}_sum{{{prefix}}} {series[-2]}'
+            yield f'{self.name}_count{{{prefix}}} {series[-1]}'
+
+
+class Registry:
+    """Метрики запросов по вьюсету, действию, методу и статусу."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.duration = Histogram(
+            'foodgram_request_duration_seconds',
+            'Время обработки запроса.', DURATION_BUCKETS
+        )
+        self.queries = Histogram(
+            'foodgram_request_db_queries',
+            'Число запросов к БД за запрос.', QUERY_BUCKETS
+        )
+        self.db_time = Histogram(
+            'foodgram_request_db_duration_seconds',
+            'Время запросов к БД за запрос.', DURATION_BUCKETS
+        )
+        self.serialize_time = Histogram(
+            'foodgram_request_serialize_duration_seconds',
+            'Время serializer.data (to_representation) за запрос.',
+            DURATION_BUCKETS
+        )
+        self.render_time = Histogram(
+            'foodgram_request_render_duration_seconds',
+            'Время рендеринга ответа DRF в тело (JSON, PDF).',
+            DURATION_BUCKETS
+        )
+        self.size = Histogram(
+            'foodgram_response_size_bytes',
+            'Размер тела ответа.', SIZE_BUCKETS
+        )
+
+    def record(self, labels, stats):
+        with self.lock:
+            self.duration.observe(labels, stats.duration)
+            self.queries.observe(labels, stats.count)
+            self.db_time.observe(labels, stats.db_time)
+            if stats.serialize_time is not None:
+                self.serialize_time.observe(labels, stats.serialize_time)
+            if stats.render_time is not None:
+                self.render_time.observe(labels, stats.render_time)
+            self.size.observe(labels, stats.size)
+
+    def render(self):
+        with self.lock:
+            lines = [
+                line
+                for histogram in (self.duration, self.queries, self.db_time,
+                                  self.serialize_time, self.render_time,
+                                  self.size)
+                for line in histogram.collect()
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def fingerprint(sql):
+    """SQL без значений: одинаковые запросы с разными id совпадают."""
+    sql = LITERALS.sub('?', sql)
+    sql = PLACEHOLDER_LISTS.sub('(...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+class RequestStats:
+    """execute_wrapper, который собирает запросы к БД одного запроса."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = 0
+        self.count = 0
+        self.db_time = 0
+        self.serialize_time = None
+        self.render_time = None
+        self.size = 0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.count += 1
+            self.statements.append(sql)
+
+    def capture(self):
+        """Контекст, в котором запросы ко всем базам попадают в stats."""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+def get_view_labels(request):
+    """Класс вьюсета и действие, для прочих вью - имя маршрута."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', ''
+    view = getattr(match.func, 'cls', None)
+    if view is None:
+        return match.view_name, ''
+    actions = getattr(match.func, 'actions', None) or {}
+    return view.__name__, actions.get(request.method.lower(), '')
+
+
+class MetricsMiddleware:
+    """
+    Собирает для каждого запроса время, число и время запросов к БД,
+    время сериализации (SerializeTimeMixin), время рендеринга
+    и размер ответа. Запросы, сделавшие не меньше
+    METRICS_QUERY_THRESHOLD обращений к БД, пишутся в лог вместе
+    с самыми частыми шаблонами SQL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        request.metrics = stats
+        with stats.capture():
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response, response.streaming_content, stats
+            )
+        else:
+            stats.size = len(response.content)
+            self.finish(request, response, stats)
+        return response
+
+    def process_template_response(self, request, response):
+        start = time.perf_counter()
+
+        def rendered(response):
+            request.metrics.render_time = time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def stream(self, request, response, content, stats):
+        """Потоковый ответ учитывается, когда он отдан целиком."""
+        chunks = iter(content)
+        while True:
+            with stats.capture():
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            stats.size += len(chunk)
+            yield chunk
+        self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        stats.duration = time.perf_counter() - stats.start
+        view, action = get_view_labels(request)
+        status = f'{response.status_code // 100}xx'
+        registry.record((view, action, request.method, status), stats)
+        if stats.count >= settings.METRICS_QUERY_THRESHOLD:
+            self.report(request, view, action, stats)
+
+    def report(self, request, view, action, stats):
+        top = Counter(map(fingerprint, stats.statements)).most_common(
+            settings.METRICS_LOGGED_FINGERPRINTS
+        )
+        logger.warning(
+            '%s %s (%s.%s): %d запросов к БД за %.1f мс, всего %.1f мс\n%s',
+            request.method, request.get_full_path(), view, action or '-',
+            stats.count, stats.db_time * 1000, stats.duration * 1000,
+            '\n'.join(f'{count} x {sql}' for sql, count in top)
+        )
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus."""
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
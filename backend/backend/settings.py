@@ -1,9 +1,16 @@
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
+
+
+def env_bool(name, default=False):
+    return os.getenv(name, default=str(default)).lower() in ('1', 'true', 'yes')
+
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -12,7 +19,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv('SECRET_KEY', default='u*-#rt#6=r_a1j6m_i0af=)ro1r3c1*476pl#*h_)00q-dt!$t')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = env_bool('DEBUG')
 
 ALLOWED_HOSTS = [
     '127.0.0.1',
@@ -44,7 +51,9 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'backend.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'backend.db.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -73,23 +82,118 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# По умолчанию SQLite для локальной разработки; с DB_ENGINE=...postgresql
+# настройки берутся из окружения. Соединения переиспользуются
+# DB_CONN_MAX_AGE секунд, а с DB_HEALTH_CHECKS при первом использовании
+# в запросе проверяются и переоткрываются, если база их разорвала.
+DB_ENGINE = os.getenv('DB_ENGINE', default='django.db.backends.sqlite3')
+DB_HEALTH_CHECKS = env_bool('DB_HEALTH_CHECKS', default=False)
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.getenv('DB_NAME', default=BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+            'OPTIONS': {
+                # Сколько секунд ждать снятия блокировки записи.
+                'timeout': int(os.getenv('DB_BUSY_TIMEOUT', default=20)),
+            },
+        }
+    }
+else:
+    # За pgbouncer в режиме transaction нельзя использовать
+    # серверные курсоры и параметры запуска сессии.
+    DB_PGBOUNCER = env_bool('DB_PGBOUNCER')
+    DB_OPTIONS = {
+        'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', default=5)),
+    }
+    if os.getenv('DB_STATEMENT_TIMEOUT') and not DB_PGBOUNCER:
+        DB_OPTIONS['options'] = (
+            f'-c statement_timeout={os.getenv("DB_STATEMENT_TIMEOUT")}'
+        )
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.getenv('DB_NAME'),
+            'USER': os.getenv('POSTGRES_USER'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
+            'HOST': os.getenv('DB_HOST'),
+            'PORT': os.getenv('DB_PORT'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+            'DISABLE_SERVER_SIDE_CURSORS': env_bool(
+                'DB_DISABLE_SERVER_SIDE_CURSORS', default=DB_PGBOUNCER
+            ),
+            'OPTIONS': DB_OPTIONS,
+        }
     }
+
+# Реплики только для чтения через запятую: пути к файлам SQLite
+# или хосты PostgreSQL с теми же учётными данными.
+REPLICA_DATABASES = []
+for index, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', default='').split(',')), 1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME' if DB_ENGINE == 'django.db.backends.sqlite3' else 'HOST':
+            replica.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['backend.db.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', default=10))
+
+# Прагмы для каждого соединения с SQLite: WAL позволяет читать
+# параллельно с записью, поэтому воркеры gunicorn не ждут друг друга.
+SQLITE_PRAGMAS = (
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'cache_size=-20000',
+    'temp_store=MEMORY',
+    'mmap_size=134217728',
+)
+
+
+# Кеши общие для всех воркеров: через них расходятся сбросы связей
+# пользователя (флаги избранного и подписок), токенов и ответов.
+# Без DEBUG нужен memcached или redis: у LocMemCache в каждом процессе
+# своя копия, а FileBasedCache при каждой записи обходит весь каталог.
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+if DEBUG:
+    DEFAULT_CACHE_BACKEND, DEFAULT_CACHE_LOCATION = LOCAL_CACHE_BACKENDS[0], ''
+else:
+    DEFAULT_CACHE_BACKEND = 'django.core.cache.backends.memcached.PyMemcacheCache'
+    DEFAULT_CACHE_LOCATION = 'memcached:11211'
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', default=DEFAULT_CACHE_BACKEND),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=DEFAULT_CACHE_LOCATION),
+    },
+    # Ответы ленты и рецептов для анонимов.
+    'responses': {
+        'BACKEND': os.getenv('RESPONSE_CACHE_BACKEND', default=DEFAULT_CACHE_BACKEND),
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', default=DEFAULT_CACHE_LOCATION),
+        'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=300)),
+        'KEY_PREFIX': 'responses',
+    },
 }
+for alias, cache_settings in CACHES.items():
+    if cache_settings['BACKEND'] in LOCAL_CACHE_BACKENDS and not DEBUG:
+        raise ImproperlyConfigured(
+            f'Кеш {alias} должен быть общим для всех процессов: '
+            f'{cache_settings["BACKEND"]} можно использовать только '
+            f'с DEBUG=True'
+        )
 
-# DATABASES = {
-#    'default': {
-#        'ENGINE': os.getenv('DB_ENGINE', default='django.db.backends.postgresql'),
-#        'NAME': os.getenv('DB_NAME'),
-#        'USER': os.getenv('POSTGRES_USER'),
-#        'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
-#        'HOST': os.getenv('DB_HOST'),
-#        'PORT': os.getenv('DB_PORT'),
-#    }
-# }
+RESPONSE_CACHE_ALIAS = 'responses'
+USER_RELATIONS_TIMEOUT = 60
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = 60
 
 
 # Password validation
@@ -127,6 +231,27 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Сколько ингредиентов возвращает поиск по названию.
+INGREDIENT_SEARCH_LIMIT = 20
+BULK_MAX_IDS = 100
+# Подбор рецептов по имеющимся ингредиентам.
+WHAT_TO_COOK_LIMIT = 10
+WHAT_TO_COOK_MAX_LIMIT = 50
+WHAT_TO_COOK_MAX_INGREDIENTS = 50
+
+# Запросы к API, сделавшие столько обращений к БД, пишутся в лог
+# вместе с самыми частыми шаблонами SQL.
+METRICS_QUERY_THRESHOLD = int(os.getenv('METRICS_QUERY_THRESHOLD', default=30))
+METRICS_LOGGED_FINGERPRINTS = 5
+
+# Кэш pdf со списками покупок: каталог пользователя и хэш корзины.
+SHOPPING_LIST_CACHE_DIR = os.path.join(BASE_DIR, 'shopping_lists/')
+SHOPPING_LIST_PDF_WORKERS = int(os.getenv('SHOPPING_LIST_PDF_WORKERS', default=2))
+SHOPPING_LIST_PDF_TIMEOUT = 60
+# Сколько секунд хранится pdf и как часто удаляются устаревшие.
+SHOPPING_LIST_PDF_TTL = int(os.getenv('SHOPPING_LIST_PDF_TTL', default=24 * 60 * 60))
+SHOPPING_LIST_CLEANUP_INTERVAL = 60 * 60
+
 AUTH_USER_MODEL = 'users.User'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -137,7 +262,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
 }
 
@@ -48,9 +48,10 @@ class RecipeAdmin(BaseAdminSettings):
     filter_horizontal = ('tags',)
 
     def added_in_favorites(self, obj):
-        return obj.favorites.all().count()
+        return obj.favorites_count
 
     added_in_favorites.short_description = 'Количество добавлений в избранное'
+    added_in_favorites.admin_order_field = 'favorites_count'
 
 
 @admin.register(IngredientInRecipe)
@@ -0,0 +1,105 @@
+"""
+Полнотекстовый индекс по названию и описанию рецептов.
+
+На PostgreSQL это вычисляемый столбец search_vector (конфигурация
+russian, название весомее описания) с GIN-индексом, на SQLite -
+таблица FTS5 с внешним содержимым, которую обновляют триггеры.
+В обоих случаях индекс меняется той же командой, что и рецепт,
+в том числе при bulk_create и update().
+"""
+
+FTS_TABLE = 'recipes_recipe_fts'
+
+POSTGRESQL_CREATE = (
+    "ALTER TABLE recipes_recipe ADD COLUMN IF NOT EXISTS search_vector "
+    "tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(text, '')), 'B')"
+    ") STORED",
+    'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+POSTGRESQL_DROP = (
+    'DROP INDEX IF EXISTS recipe_search_vector_idx',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+)
+
+SQLITE_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"name, text, content='recipes_recipe', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')"
+)
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_insert': (
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert '
+        f'AFTER INSERT ON recipes_recipe BEGIN '
+        f'INSERT INTO {FTS_TABLE}(rowid, name, text) '
+        f'VALUES (new.id, new.name, new.text); END'
+    ),
+    f'{FTS_TABLE}_delete': (
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete '
+        f'AFTER DELETE ON recipes_recipe BEGIN '
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text) "
+        f"VALUES ('delete', old.id, old.name, old.text); END"
+    ),
+    f'{FTS_TABLE}_update': (
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update '
+        f'AFTER UPDATE OF name, text ON recipes_recipe BEGIN '
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text) "
+        f"VALUES ('delete', old.id, old.name, old.text); "
+        f'INSERT INTO {FTS_TABLE}(rowid, name, text) '
+        f'VALUES (new.id, new.name, new.text); END'
+    ),
+}
+SQLITE_REBUILD = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+SQLITE_DROP = tuple(
+    f'DROP TRIGGER IF EXISTS {name}' for name in SQLITE_TRIGGERS
+) + (f'DROP TABLE IF EXISTS {FTS_TABLE}',)
+
+
+def create_search_index(connection):
+    """Создаёт индекс и заполняет его существующими рецептами."""
+    if connection.vendor == 'postgresql':
+        statements = POSTGRESQL_CREATE
+    elif connection.vendor == 'sqlite':
+        statements = (SQLITE_TABLE, *SQLITE_TRIGGERS.values(), SQLITE_REBUILD)
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def drop_search_index(connection):
+    statements = {
+        'postgresql': POSTGRESQL_DROP,
+        'sqlite': SQLITE_DROP,
+    }.get(connection.vendor, ())
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def repair_sqlite_triggers(connection):
+    """
+    SQLite пересоздаёт таблицу при изменении столбцов в миграциях,
+    и триггеры удаляются вместе со старой таблицей. Возвращает их
+    и перестраивает индекс, если чего-то не хватает.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name = 'recipes_recipe'"
+        )
+        existing = {name for name, in cursor.fetchall()}
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name = %s", [FTS_TABLE]
+        )
+        if cursor.fetchone() is None or existing >= set(SQLITE_TRIGGERS):
+            return
+        for statement in SQLITE_TRIGGERS.values():
+            cursor.execute(statement)
+        cursor.execute(SQLITE_REBUILD)
@@ -0,0 +1,77 @@
+import hashlib
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, features
+
+# Название варианта -> максимальные ширина и высота в пикселях.
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+RENDITIONS_DIR = 'recipes/images/renditions'
+
+if features.check('webp'):
+    RENDITION_FORMAT, RENDITION_EXTENSION = 'WEBP', 'webp'
+else:
+    RENDITION_FORMAT, RENDITION_EXTENSION = 'JPEG', 'jpg'
+
+
+def file_digest(file, chunk_size=64 * 1024):
+    """Возвращает sha256 содержимого файла, читая его по частям."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def build_renditions(image):
+    """
+    Создаёт уменьшенные копии изображения для всех размеров из RENDITIONS.
+
+    Имена файлов строятся по хэшу исходника, поэтому повторная загрузка
+    той же картинки не создаёт новых файлов.
+    Возвращает словарь {вариант: {'name': путь, 'width': ширина}}.
+    """
+    image.open('rb')
+    try:
+        digest = file_digest(image)[:16]
+        source = Image.open(image)
+        source.load()
+    finally:
+        image.close()
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'A' in source.getbands() else 'RGB')
+    if RENDITION_FORMAT == 'JPEG' and source.mode == 'RGBA':
+        source = source.convert('RGB')
+
+    renditions = {}
+    for variant, size in RENDITIONS.items():
+        name = os.path.join(
+            RENDITIONS_DIR,
+            f'{digest}_{variant}.{RENDITION_EXTENSION}'
+        )
+        rendition = source.copy()
+        rendition.thumbnail(size, Image.LANCZOS)
+        if not default_storage.exists(name):
+            buffer = io.BytesIO()
+            rendition.save(buffer, RENDITION_FORMAT, quality=80)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+        renditions[variant] = {'name': name, 'width': rendition.width}
+    return renditions
+
+
+def get_srcset(renditions, build_url=None):
+    """Формирует значение атрибута srcset из сохранённых вариантов."""
+    candidates = []
+    for rendition in sorted(renditions.values(), key=lambda r: r['width']):
+        url = default_storage.url(rendition['name'])
+        if build_url is not None:
+            url = build_url(url)
+        candidates.append(f'{url} {rendition["width"]}w')
+    return ', '.join(candidates)
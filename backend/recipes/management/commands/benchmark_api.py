@@ -0,0 +1,215 @@
+import json
+import math
+import platform
+import random
+import time
+import tracemalloc
+from contextlib import ExitStack
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(timings, value):
+    """Перцентиль по ближайшему рангу для отсортированного списка."""
+    return timings[max(0, math.ceil(len(timings) * value / 100) - 1)]
+
+
+def with_query(url, **params):
+    return f'{url}?{urlencode(params, doseq=True)}' if params else url
+
+
+class Command(BaseCommand):
+    """Менеджкоманда для замера основных эндпоинтов API"""
+    help = (
+        'Прогоняет ленту, ленту с фильтрами, рецепт, подписки, поиск '
+        'ингредиентов и выгрузку списка покупок через тестовый клиент '
+        'и выводит перцентили времени, число запросов к БД и пик '
+        'памяти в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Сколько раз замерять каждый эндпоинт')
+        parser.add_argument('--warmup', type=int, default=3,
+                            help='Сколько запросов сделать до замера')
+        parser.add_argument('--username',
+                            help='От чьего имени делать запросы, по '
+                                 'умолчанию - пользователь с самым '
+                                 'большим списком покупок')
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кеши перед каждым запросом')
+        parser.add_argument('--cart-format', default='txt',
+                            help='Формат выгрузки списка покупок')
+        parser.add_argument('--only', action='append', default=[],
+                            help='Замерить только этот эндпоинт, '
+                                 'можно указать несколько раз')
+        parser.add_argument('--output',
+                            help='Файл для отчёта, по умолчанию stdout')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Зерно для выбора строки поиска '
+                                 'ингредиентов, чтобы прогоны можно было '
+                                 'сравнивать')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть не меньше 1')
+        user = self.get_user(options['username'])
+        token, _ = Token.objects.get_or_create(user=user)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        endpoints = self.get_endpoints(
+            user, options['cart_format'], options['seed']
+        )
+        unknown = set(options['only']) - set(endpoints)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные эндпоинты: {", ".join(sorted(unknown))}'
+            )
+        results = {}
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        with override_settings(ALLOWED_HOSTS=hosts):
+            for name, url in endpoints.items():
+                if options['only'] and name not in options['only']:
+                    continue
+                results[name] = self.measure(client, url, options)
+                if not 200 <= results[name]['status'] < 300:
+                    self.stderr.write(
+                        f'{name}: ответ {results[name]["status"]}'
+                    )
+        report = {
+            'meta': {
+                'started_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'user': user.username,
+                'recipes': Recipe.objects.count(),
+                'users': User.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+                'repeat': options['repeat'],
+                'warmup': options['warmup'],
+                'cold': options['cold'],
+                'seed': options['seed'],
+            },
+            'endpoints': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = User.objects.annotate(
+                cart_size=Count('shopping_cart')
+            ).order_by('-cart_size', 'id').first()
+        if user is None:
+            raise CommandError(
+                'Пользователь не найден, заполните БД командой seed_data'
+            )
+        return user
+
+    def get_endpoints(self, user, cart_format, seed):
+        """
+        Адреса эндпоинтов с параметрами по данным из БД. При одних
+        данных и одном seed адреса всегда одинаковые.
+        """
+        recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+        if recipe is None:
+            raise CommandError('В БД нет рецептов, запустите seed_data')
+        slugs = list(Tag.objects.annotate(
+            total=Count('recipes')
+        ).order_by('-total', 'id').values_list('slug', flat=True)[:2])
+        ingredients = Ingredient.objects.order_by('id')
+        total = ingredients.count()
+        name = ''
+        if total:
+            name = ingredients.values_list('name', flat=True)[
+                random.Random(seed).randrange(total)
+            ]
+        recipes = reverse('api:recipe-list')
+        return {
+            'feed': recipes,
+            'feed_filtered': with_query(
+                recipes, tags=slugs, is_favorited=1
+            ),
+            'recipe_detail': reverse('api:recipe-detail', args=(recipe.pk,)),
+            'subscriptions': reverse('users:user-subscriptions'),
+            'ingredient_search': with_query(
+                reverse('api:ingredient-list'), name=name[:3]
+            ),
+            'cart_download': with_query(
+                reverse('api:recipe-download-shopping-cart'),
+                format=cart_format
+            ),
+        }
+
+    def request(self, client, url, cold):
+        """Запрос вместе с чтением тела, в том числе потокового."""
+        if cold:
+            for cache in caches.all():
+                cache.clear()
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        else:
+            response.content
+        response.close()
+        return response
+
+    def measure(self, client, url, options):
+        """
+        Время замеряется отдельно от запросов к БД и памяти:
+        tracemalloc заметно замедляет выполнение.
+        """
+        for _ in range(options['warmup']):
+            self.request(client, url, options['cold'])
+        timings = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            response = self.request(client, url, options['cold'])
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(db))
+                for db in connections.all()
+            ]
+            tracemalloc.start()
+            try:
+                self.request(client, url, options['cold'])
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        result = {'url': url, 'status': response.status_code}
+        for value in PERCENTILES:
+            result[f'p{value}_ms'] = round(percentile(timings, value), 3)
+        result.update(
+            mean_ms=round(sum(timings) / len(timings), 3),
+            max_ms=round(timings[-1], 3),
+            queries=sum(len(context) for context in contexts),
+            peak_memory_kb=round(peak / 1024, 1),
+        )
+        return result
@@ -0,0 +1,136 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from django.test import RequestFactory
+
+from api.filters import RecipeFilter
+from recipes.models import Recipe, Tag
+
+User = get_user_model()
+
+
+def legacy_filter(user, tags=(), is_favorited=False,
+                  is_in_shopping_cart=False):
+    """Фильтрация рецептов в том виде, в каком она была через JOIN."""
+    queryset = Recipe.objects.all()
+    if tags:
+        query = Q()
+        for slug in tags:
+            query |= Q(tags__slug=slug)
+        queryset = queryset.filter(query).distinct()
+    if is_favorited:
+        queryset = queryset.filter(favorites__user=user)
+    if is_in_shopping_cart:
+        queryset = queryset.filter(shopping_cart__user=user)
+    return queryset
+
+
+class Command(BaseCommand):
+    """Менеджкоманда для замера фильтров ленты рецептов"""
+    help = (
+        'Сравнивает фильтрацию ленты через JOIN и через подзапросы, '
+        'при необходимости дозаполняя БД командой seed_data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=0,
+            help='Довести число рецептов в БД до этого значения'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз выполнять каждый запрос'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько строк записывать за один запрос'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=1,
+            help='Зерно seed_data для повторяемых данных'
+        )
+
+    def handle(self, *args, **options):
+        existing = Recipe.objects.count()
+        missing = options['recipes'] - existing
+        if missing > 0:
+            # seed_data не повторяет уже использованное зерно, поэтому
+            # каждое дозаполнение получает своё, зависящее от --seed
+            # и числа рецептов: тот же запуск на той же БД повторяем.
+            seed = random.Random(
+                f'{options["seed"]}-{existing}'
+            ).randrange(2 ** 31)
+            call_command(
+                'seed_data', recipes=missing, seed=seed,
+                batch_size=options['batch_size'], stdout=self.stdout
+            )
+        user = self.get_user()
+        slugs = list(Tag.objects.order_by('id').values_list('slug', flat=True))
+        if not slugs:
+            raise CommandError('В БД нет тегов, запустите с --recipes')
+        request = RequestFactory().get('/api/recipes/')
+        request.user = user
+        cases = (
+            ('один тег', {'tags': slugs[:1]}),
+            ('несколько тегов', {'tags': slugs[:3]}),
+            ('избранное', {'is_favorited': True}),
+            ('список покупок', {'is_in_shopping_cart': True}),
+            ('теги и избранное', {'tags': slugs[:2], 'is_favorited': True}),
+        )
+        self.stdout.write(
+            f'Рецептов: {Recipe.objects.count()}, '
+            f'повторов: {options["repeat"]}'
+        )
+        for title, params in cases:
+            data = {
+                key: value if key == 'tags' else '1'
+                for key, value in params.items()
+            }
+            before = self.measure(
+                legacy_filter(user, **params), options['repeat']
+            )
+            after = self.measure(
+                RecipeFilter(data, Recipe.objects.all(), request=request).qs,
+                options['repeat']
+            )
+            if before[2] != after[2]:
+                raise CommandError(f'Результаты различаются: {title}')
+            self.stdout.write(
+                f'{title}: найдено {before[2][0]}, '
+                f'JOIN {before[0]:.1f}/{before[1]:.1f} мс, '
+                f'подзапросы {after[0]:.1f}/{after[1]:.1f} мс (медиана/p95)'
+            )
+
+    def get_user(self):
+        """Пользователь с самыми большими избранным и списком покупок."""
+        user = User.objects.annotate(
+            total=Count('favorites', distinct=True)
+            + Count('shopping_cart', distinct=True)
+        ).order_by('-total', 'id').first()
+        if user is None:
+            raise CommandError('В БД нет пользователей, запустите с --recipes')
+        return user
+
+    def measure(self, queryset, repeat):
+        """
+        Время в мс того, что делает постраничная лента: COUNT(*)
+        и первая страница. Возвращает медиану, p95 и сам результат.
+        """
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = (
+                queryset.count(),
+                list(queryset.order_by('-pub_date', '-id').values_list(
+                    'id', flat=True
+                )[:6]),
+            )
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        return statistics.median(timings), p95, result
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Менеджкоманда для создания уменьшенных копий изображений рецептов"""
+    help = 'Создаёт уменьшенные копии изображений для уже загруженных рецептов'
+
+    def handle(self, *args, **options):
+        updated = 0
+        for recipe in Recipe.objects.exclude(image='').iterator():
+            source = recipe.image_renditions.get('source')
+            recipe.update_renditions()
+            updated += source != recipe.image_renditions.get('source')
+        self.stdout.write(f'Обновлено рецептов: {updated}')
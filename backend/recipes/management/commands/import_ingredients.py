@@ -1,13 +1,22 @@
-import logging
 import csv
+import io
+import json
+import logging
+import os
+from itertools import islice
 
 from accessify import private
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from api.catalog import bump_catalog_version
 from recipes.models import Ingredient
 
 MESSAGE = 'Данные успешно загружены в таблицу'
+DEFAULT_FILE = os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv')
+JSON_READ_SIZE = 64 * 1024
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -16,20 +25,133 @@ logging.basicConfig(
 )
 
 
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """
+    Потоково читает json-массив объектов, не загружая файл целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидался json-массив ингредиентов')
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный json')
+            chunk = file.read(JSON_READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield item['name'], item['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
 class Command(BaseCommand):
     """Менеджкоманда для загрузки ингридиентов в БД"""
+    help = 'Загружает ингредиенты из csv или json файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file', nargs='?', default=DEFAULT_FILE,
+            help='Путь к csv или json файлу с ингредиентами'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько строк записывать за один запрос'
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Не использовать COPY даже на PostgreSQL'
+        )
+
     def handle(self, *args, **options):
-        self.import_ingredients()
-        logging.info('Загрузка данных завершена')
+        inserted, skipped = self.import_ingredients(
+            options['file'], options['batch_size'], not options['no_copy']
+        )
+        if inserted:
+            bump_catalog_version()
+        message = f'{MESSAGE}: добавлено {inserted}, пропущено {skipped}'
+        logging.info(message)
+        self.stdout.write(message)
 
     @private
-    def import_ingredients(self, file='ingredients.csv'):
+    def import_ingredients(self, file, batch_size, use_copy):
         logging.info(f'Загрузка данных из {file} в базу:')
-        file_path = f'./data/{file}'
-        with open(file_path, newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                status, created = Ingredient.objects.update_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
+        reader = READERS.get(os.path.splitext(file)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json')
+        use_copy = use_copy and connection.vendor == 'postgresql'
+        seen = set(Ingredient.objects.values_list('name', 'measurement_unit'))
+        inserted = skipped = 0
+        with open(file, newline='', encoding='utf-8') as f:
+            rows = reader(f)
+            while True:
+                chunk = list(islice(rows, batch_size))
+                if not chunk:
+                    break
+                batch = []
+                for name, measurement_unit in chunk:
+                    key = (name.strip(), measurement_unit.strip())
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    batch.append(key)
+                skipped += len(chunk) - len(batch)
+                if use_copy:
+                    inserted += self.copy_batch(batch)
+                elif batch:
+                    Ingredient.objects.bulk_create(
+                        [Ingredient(name=name, measurement_unit=unit)
+                         for name, unit in batch],
+                        ignore_conflicts=True,
+                    )
+                    inserted += len(batch)
+        return inserted, skipped
+
+    @private
+    def copy_batch(self, batch):
+        """
+        Записывает пачку через COPY во временную таблицу,
+        откуда строки переносятся с ON CONFLICT DO NOTHING.
+        Возвращает число реально добавленных строк.
+        """
+        if not batch:
+            return 0
+        table = Ingredient._meta.db_table
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE tmp_ingredient '
+                f'(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY tmp_ingredient (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT name, measurement_unit FROM tmp_ingredient '
+                f'ON CONFLICT DO NOTHING'
+            )
+            return cursor.rowcount
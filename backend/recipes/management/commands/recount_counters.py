@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.signals import COUNTERS
+
+
+def count_subquery(sender, foreign_key):
+    """Подзапрос с фактическим числом строк sender для каждой записи."""
+    return Coalesce(Subquery(
+        sender.objects.filter(**{foreign_key: OuterRef('pk')}).order_by(
+        ).values(foreign_key).annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()
+    ), 0)
+
+
+class Command(BaseCommand):
+    """Менеджкоманда для сверки денормализованных счётчиков"""
+    help = 'Пересчитывает счётчики избранного, корзины, рецептов и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько записей проверять за один запрос'
+        )
+
+    def handle(self, *args, **options):
+        targets = {}
+        for sender, target, foreign_key, field in COUNTERS:
+            targets.setdefault(target, []).append((sender, foreign_key, field))
+        for target, counters in targets.items():
+            fixed = self.recount(target, counters, options['batch_size'])
+            self.stdout.write(
+                f'{target._meta.verbose_name_plural}: исправлено {fixed}'
+            )
+
+    def recount(self, target, counters, batch_size):
+        """
+        Проходит по таблице пачками по id и исправляет только записи,
+        у которых счётчик разошёлся с фактическим числом строк.
+        """
+        fields = [field for _, _, field in counters]
+        actual = {
+            f'actual_{field}': count_subquery(sender, foreign_key)
+            for sender, foreign_key, field in counters
+        }
+        fixed = 0
+        last_id = 0
+        while True:
+            ids = list(target.objects.filter(pk__gt=last_id).order_by(
+                'pk'
+            ).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return fixed
+            last_id = ids[-1]
+            stale = []
+            batch = target.objects.filter(pk__in=ids).only(*fields)
+            for obj in batch.annotate(**actual):
+                values = {field: getattr(obj, f'actual_{field}')
+                          for field in fields}
+                if any(getattr(obj, field) != value
+                       for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(obj, field, value)
+                    stale.append(obj)
+            target.objects.bulk_update(stale, fields)
+            fixed += len(stale)
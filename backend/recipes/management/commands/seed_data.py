@@ -0,0 +1,250 @@
+import random
+from collections import Counter
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.catalog import bump_catalog_version
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
+                            IngredientPosting, Recipe, ShoppingCart, Tag)
+from recipes.signals import change_counters, get_counter
+from users.models import Subscribe
+
+User = get_user_model()
+
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+AMOUNTS = (1, 2, 3, 4, 5, 10, 20, 50, 100, 150, 200, 250, 300, 500)
+# Сколько ингредиентов и тегов бывает у рецепта.
+INGREDIENTS_PER_RECIPE = (3, 12)
+TAGS_PER_RECIPE = (1, 3)
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sample_counts(total, average, limit):
+    """Случайные размеры выборок со средним average, не больше limit."""
+    return [min(limit, random.randint(0, 2 * average)) for _ in range(total)]
+
+
+def add_counts(model, field, ids):
+    """Увеличивает счётчики одним UPDATE на каждое значение прироста."""
+    by_delta = {}
+    for pk, delta in Counter(ids).items():
+        by_delta.setdefault(delta, []).append(pk)
+    for delta, pks in by_delta.items():
+        for batch in batches(pks, 900):
+            change_counters(model, batch, field, delta)
+
+
+class Command(BaseCommand):
+    """Менеджкоманда для заполнения БД тестовыми данными"""
+    help = (
+        'Создаёт пользователей, теги, ингредиенты, рецепты, избранное, '
+        'списки покупок и подписки пакетными запросами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100,
+                            help='Сколько создать пользователей')
+        parser.add_argument('--recipes', type=int, default=1000,
+                            help='Сколько создать рецептов')
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Сколько тегов должно быть в БД')
+        parser.add_argument('--ingredients', type=int, default=500,
+                            help='Сколько ингредиентов должно быть в БД')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Сколько рецептов в избранном '
+                                 'у пользователя в среднем')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Сколько рецептов в списке покупок '
+                                 'у пользователя в среднем')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='На скольких авторов пользователь '
+                                 'подписан в среднем')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Сколько строк записывать за один запрос')
+        parser.add_argument('--seed', type=int,
+                            help='Зерно генератора для повторяемых данных')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        # С --seed имена тоже повторяются, и два запуска на пустой
+        # базе дают одинаковые данные.
+        if options['seed'] is None:
+            self.prefix = f'seed-{uuid4().hex[:8]}'
+        else:
+            self.prefix = f'seed-{options["seed"]}'
+        if self.already_seeded():
+            raise CommandError(
+                f'Данные с --seed {options["seed"]} уже есть в БД, '
+                f'укажите другое значение'
+            )
+        tags = self.seed_tags(options['tags'])
+        ingredients = self.seed_ingredients(options['ingredients'])
+        users = self.seed_users(options['users'])
+        self.seed_recipes(options['recipes'], users, tags, ingredients)
+        recipes = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True)
+        )
+        self.seed_user_relations(Favorite, users, recipes,
+                                 options['favorites'])
+        self.seed_user_relations(ShoppingCart, users, recipes,
+                                 options['cart'])
+        self.seed_user_relations(Subscribe, users, users,
+                                 options['subscriptions'])
+        # bulk_create не отправляет сигналы, новая версия каталога
+        # сбрасывает каталог и кеш ответов во всех процессах.
+        transaction.on_commit(bump_catalog_version)
+
+    def already_seeded(self):
+        return User.objects.filter(
+            username__startswith=f'{self.prefix}-'
+        ).exists() or Recipe.objects.filter(
+            name__startswith=f'Рецепт {self.prefix}-'
+        ).exists()
+
+    def bulk_create(self, model, objects, **kwargs):
+        for batch in batches(objects, self.batch_size):
+            model.objects.bulk_create(batch, **kwargs)
+
+    def seed_tags(self, total):
+        tags = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        missing = total - len(tags)
+        if missing > 0:
+            self.bulk_create(Tag, [
+                Tag(name=f'{self.prefix}-{index}',
+                    slug=f'{self.prefix}-{index}',
+                    color=f'#{random.getrandbits(24):06x}')
+                for index in range(missing)
+            ], ignore_conflicts=True)
+            tags = list(
+                Tag.objects.order_by('id').values_list('id', flat=True)
+            )
+        self.stdout.write(f'Тегов: {len(tags)}')
+        return tags
+
+    def seed_ingredients(self, total):
+        ingredients = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        missing = total - len(ingredients)
+        if missing > 0:
+            self.bulk_create(Ingredient, [
+                Ingredient(name=f'ингредиент {self.prefix}-{index}',
+                           measurement_unit=random.choice(UNITS))
+                for index in range(missing)
+            ])
+            ingredients = list(
+                Ingredient.objects.order_by('id').values_list('id', flat=True)
+            )
+        self.stdout.write(f'Ингредиентов: {len(ingredients)}')
+        return ingredients
+
+    def seed_users(self, total):
+        password = make_password(None)
+        self.bulk_create(User, [
+            User(username=f'{self.prefix}-{index}',
+                 email=f'{self.prefix}-{index}@example.com',
+                 first_name='Тестовый', last_name=f'Пользователь {index}',
+                 password=password)
+            for index in range(total)
+        ])
+        users = list(User.objects.filter(
+            username__startswith=f'{self.prefix}-'
+        ).order_by('id').values_list('id', flat=True))
+        self.stdout.write(f'Создано пользователей: {len(users)}')
+        return users
+
+    def seed_recipes(self, total, users, tags, ingredients):
+        """
+        Рецепты с 3-12 ингредиентами и 1-3 тегами. Авторы выбираются
+        неравномерно: у первых пользователей рецептов больше всего.
+        """
+        if not total or not users or not ingredients:
+            return
+        authors = random.choices(
+            users, weights=[1 / rank for rank in range(1, len(users) + 1)],
+            k=total
+        )
+        self.bulk_create(Recipe, [
+            Recipe(author_id=author, name=f'Рецепт {self.prefix}-{index}',
+                   text='Тестовый рецепт',
+                   cooking_time=random.randint(1, 180))
+            for index, author in enumerate(authors)
+        ])
+        recipes = list(Recipe.objects.filter(
+            name__startswith=f'Рецепт {self.prefix}-'
+        ).order_by('id').values_list('id', flat=True))
+        add_counts(User, 'recipes_count', authors)
+
+        composition = {
+            recipe: [
+                (ingredient, random.choice(AMOUNTS))
+                for ingredient in random.sample(ingredients, min(
+                    len(ingredients), random.randint(*INGREDIENTS_PER_RECIPE)
+                ))
+            ]
+            for recipe in recipes
+        }
+        pairs = {pair for items in composition.values() for pair in items}
+        self.bulk_create(IngredientInRecipe, [
+            IngredientInRecipe(ingredient_id=ingredient, amount=amount)
+            for ingredient, amount in pairs
+        ], ignore_conflicts=True)
+        pair_ids = {
+            (ingredient, amount): pk
+            for pk, ingredient, amount in IngredientInRecipe.objects.filter(
+                amount__in=AMOUNTS
+            ).values_list('id', 'ingredient_id', 'amount').iterator()
+        }
+        self.bulk_create(Recipe.ingredients.through, [
+            Recipe.ingredients.through(
+                recipe_id=recipe, ingredientinrecipe_id=pair_ids[pair]
+            )
+            for recipe, items in composition.items() for pair in items
+        ])
+        self.bulk_create(IngredientPosting, [
+            IngredientPosting(recipe_id=recipe, ingredient_id=ingredient,
+                              ingredients_count=len(items))
+            for recipe, items in composition.items()
+            for ingredient, _ in items
+        ])
+        if tags:
+            self.bulk_create(Recipe.tags.through, [
+                Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+                for recipe in recipes
+                for tag in random.sample(tags, min(
+                    len(tags), random.randint(*TAGS_PER_RECIPE)
+                ))
+            ])
+        self.stdout.write(f'Создано рецептов: {len(recipes)}')
+
+    def seed_user_relations(self, model, users, targets, average):
+        """
+        Избранное, список покупок или подписки новых пользователей.
+        Счётчики увеличиваются сразу, так как сигналы не отправляются.
+        """
+        target, foreign_key, field = get_counter(model)
+        counts = sample_counts(len(users), average, len(targets))
+        rows = []
+        for user, count in zip(users, counts):
+            rows += [
+                (user, pk) for pk in random.sample(targets, count)
+                if model is not Subscribe or pk != user
+            ]
+        self.bulk_create(model, [
+            model(user_id=user, **{foreign_key: pk})
+            for user, pk in rows
+        ])
+        add_counts(target, field, [pk for _, pk in rows])
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: {len(rows)}'
+        )
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Индекс (tag_id, recipe_id) для автоматической промежуточной таблицы
+    тегов: фильтр по тегам читает только индекс. Модели у таблицы нет,
+    поэтому индекс создаётся SQL-запросом.
+    """
+
+    dependencies = [
+        ('recipes', '0011_recipe_pub_date_id_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS recipe_tags_tag_recipe_idx '
+            'ON recipes_recipe_tags (tag_id, recipe_id)',
+            'DROP INDEX IF EXISTS recipe_tags_tag_recipe_idx',
+        ),
+    ]
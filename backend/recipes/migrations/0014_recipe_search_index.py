@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from recipes.fulltext import create_search_index, drop_search_index
+
+
+def create_index(apps, schema_editor):
+    create_search_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    """
+    Полнотекстовый индекс рецептов: столбец search_vector с GIN-индексом
+    на PostgreSQL, таблица FTS5 с триггерами на SQLite. В модели его
+    нет, поэтому он создаётся SQL-запросами.
+    """
+
+    dependencies = [
+        ('recipes', '0013_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
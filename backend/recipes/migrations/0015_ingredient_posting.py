@@ -0,0 +1,49 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Заполняет индекс для уже существующих рецептов одним запросом.
+FILL_POSTINGS = """
+INSERT INTO recipes_ingredientposting
+    (ingredient_id, recipe_id, ingredients_count)
+SELECT DISTINCT amount.ingredient_id, link.recipe_id, totals.total
+FROM recipes_recipe_ingredients link
+JOIN recipes_ingredientinrecipe amount
+    ON amount.id = link.ingredientinrecipe_id
+JOIN (
+    SELECT link.recipe_id, COUNT(DISTINCT amount.ingredient_id) AS total
+    FROM recipes_recipe_ingredients link
+    JOIN recipes_ingredientinrecipe amount
+        ON amount.id = link.ingredientinrecipe_id
+    GROUP BY link.recipe_id
+) totals ON totals.recipe_id = link.recipe_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ingredients_count', models.PositiveSmallIntegerField(verbose_name='Ингредиентов в рецепте')),
+                ('ingredient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Рецепт с ингредиентом',
+                'verbose_name_plural': 'Индекс рецептов по ингредиентам',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ingredientposting',
+            index=models.Index(fields=['ingredient', 'recipe', 'ingredients_count'], name='ingredient_posting_idx'),
+        ),
+        migrations.RunSQL(FILL_POSTINGS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:10
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_data(apps, schema_editor):
+    """
+    Ограничения и тип amount были в моделях, но не в базе: 0007
+    удалила ограничения. Если за это время появились дубликаты или
+    количества вне диапазона smallint, миграция останавливается
+    со списком, а не с IntegrityError посреди пересоздания таблицы.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    using = schema_editor.connection.alias
+    problems = [
+        f'{model.__name__} {values}'
+        for model, fields in (
+            (Ingredient, ('name', 'measurement_unit')),
+            (Recipe, ('name', 'author')),
+        )
+        for values in model.objects.using(using).order_by().values(
+            *fields
+        ).annotate(
+            total=Count('id')
+        ).filter(total__gt=1).values_list(*fields)[:20]
+    ]
+    problems += [
+        f'IngredientInRecipe id={pk} amount={amount}'
+        for pk, amount in IngredientInRecipe.objects.using(using).exclude(
+            amount__range=(0, 32767)
+        ).values_list('id', 'amount')[:20]
+    ]
+    if problems:
+        raise RuntimeError(
+            'Перед миграцией исправьте дубликаты и количества:\n'
+            + '\n'.join(problems)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_ingredient_posting'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_data, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='amount',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1, 'Минимальное значение - 1')], verbose_name='Количество ингредиента'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_model'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipe',
+            constraint=models.UniqueConstraint(fields=('name', 'author'), name='unique_recipe_model'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# icontains и istartswith на PostgreSQL сравнивают UPPER("name"::text),
+# поэтому индексы строятся по тому же выражению.
+INDEXES = (
+    ('ingredient_name_upper_prefix_idx',
+     'btree (upper(name::text) text_pattern_ops)'),
+    ('ingredient_name_upper_trgm_idx',
+     'gin (upper(name::text) gin_trgm_ops)'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, definition in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} '
+            f'ON recipes_ingredient USING {definition}'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    """
+    Индексы для поиска ингредиентов без учёта регистра. В модели их
+    нет: в Django 3.2 у индекса по выражению нельзя задать opclasses.
+    """
+
+    dependencies = [
+        ('recipes', '0017_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
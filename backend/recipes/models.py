@@ -1,8 +1,16 @@
+from collections import Counter
+
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import connections, models, router, transaction
+from django.db.models import (BooleanField, Count, Exists, F, OuterRef,
+                              Prefetch, UniqueConstraint, Value)
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+
+from users.models import Subscribe
+from .images import build_renditions
 
 User = get_user_model()
 
@@ -55,11 +63,35 @@ class Ingredient(models.Model):
                 name='unique_ingredient_model'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['name'],
+                name='ingredient_name_prefix_idx',
+                opclasses=['varchar_pattern_ops']
+            )
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class CatalogVersion(models.Model):
+    """
+    Версия каталога тегов и ингредиентов, одна строка с id=1.
+    Хранится в базе, а не в кеше процесса, чтобы изменение из любого
+    процесса (админка, import_ingredients, seed_data) увидели все
+    воркеры.
+    """
+    version = models.CharField(max_length=64, verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = 'Версия каталога'
+
+    def __str__(self):
+        return self.version
+
+
 class IngredientInRecipe(models.Model):
     """Модель количества ингридиентов в рецепте."""
     ingredient = models.ForeignKey(
@@ -90,6 +122,76 @@ class IngredientInRecipe(models.Model):
         return f'{self.ingredient} – {self.amount}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Кверисет рецептов с пакетной загрузкой связанных данных."""
+
+    def with_related(self, user=None):
+        """
+        Подгружает автора, теги и ингредиенты фиксированным числом
+        запросов, независимо от размера страницы. Если передан user,
+        авторы аннотируются флагом is_subscribed.
+        """
+        authors = User.objects.all()
+        if user is not None and user.is_authenticated:
+            authors = authors.annotate(is_subscribed=Exists(
+                Subscribe.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        elif user is not None:
+            authors = authors.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return self.prefetch_related(
+            Prefetch('author', queryset=authors),
+            'tags',
+            Prefetch(
+                'ingredients',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """
+        Аннотирует рецепты флагами is_favorited и is_in_shopping_cart
+        для текущего пользователя.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+        )
+
+    def latest_per_author(self, author_ids, limit):
+        """
+        Не больше limit последних рецептов каждого из авторов
+        одним запросом с ROW_NUMBER() OVER (PARTITION BY author).
+        """
+        author_ids = list(author_ids)
+        if not author_ids:
+            return self.none()
+        meta = self.model._meta
+        placeholders = ', '.join(['%s'] * len(author_ids))
+        ranked = RawSQL(
+            f'SELECT id FROM ('
+            f'SELECT id, ROW_NUMBER() OVER ('
+            f'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+            f') AS position FROM {meta.db_table} '
+            f'WHERE author_id IN ({placeholders})'
+            f') AS ranked WHERE position <= %s',
+            (*author_ids, limit)
+        )
+        return self.filter(pk__in=ranked)
+
+
 class Recipe(models.Model):
     """
     Модель рецепта.
@@ -110,6 +212,12 @@ class Recipe(models.Model):
         verbose_name='Изображение',
         upload_to='recipes/images'
     )
+    image_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения'
+    )
     text = models.TextField(
         verbose_name='Описание рецепта'
     )
@@ -133,9 +241,26 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        verbose_name='Добавлений в избранное'
+    )
+    cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в список покупок'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         constraints = [
@@ -143,10 +268,166 @@ class Recipe(models.Model):
                 fields=['name', 'author'],
                 name='unique_recipe_model')
         ]
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.update_renditions()
+
+    def update_renditions(self):
+        """Пересобирает копии изображения, если исходник изменился."""
+        source = self.image.name if self.image else ''
+        if self.image_renditions.get('source', '') == source:
+            return
+        try:
+            variants = build_renditions(self.image) if source else {}
+        except OSError:
+            variants = {}
+        self.image_renditions = {'source': source, 'variants': variants}
+        Recipe.objects.filter(pk=self.pk).update(
+            image_renditions=self.image_renditions
+        )
+
+
+class IngredientPostingQuerySet(models.QuerySet):
+    """Обновление и чтение индекса ингредиент -> рецепты."""
+
+    def rebuild(self, recipe_ids):
+        """Пересобирает записи индекса для рецептов recipe_ids."""
+        recipe_ids = list(recipe_ids)
+        rows = list(Recipe.ingredients.through.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list(
+            'recipe_id', 'ingredientinrecipe__ingredient_id'
+        ).distinct())
+        totals = Counter(recipe_id for recipe_id, _ in rows)
+        with transaction.atomic():
+            self.filter(recipe_id__in=recipe_ids).delete()
+            self.bulk_create([
+                self.model(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                           ingredients_count=totals[recipe_id])
+                for recipe_id, ingredient_id in rows
+            ])
+
+    def top_recipes(self, ingredient_ids, limit):
+        """
+        Тройки (рецепт, совпало, не хватает) для limit рецептов,
+        в которых есть хотя бы один из ингредиентов: сначала те,
+        где не хватает меньше всего, затем где совпало больше.
+        Читается только индекс (ingredient, recipe, ingredients_count).
+        """
+        return list(self.filter(ingredient_id__in=ingredient_ids).values(
+            'recipe_id', 'ingredients_count'
+        ).annotate(
+            matched=Count('*')
+        ).annotate(
+            missing=F('ingredients_count') - F('matched')
+        ).order_by('missing', '-matched', '-recipe_id').values_list(
+            'recipe_id', 'matched', 'missing'
+        )[:limit])
+
+
+class IngredientPosting(models.Model):
+    """
+    Инвертированный индекс: ингредиент -> рецепты, в которых он есть,
+    вместе с числом ингредиентов рецепта. Обновляется при изменении
+    ингредиентов рецепта.
+    """
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_index=False,
+        verbose_name='Ингредиент',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт',
+    )
+    ingredients_count = models.PositiveSmallIntegerField(
+        verbose_name='Ингредиентов в рецепте'
+    )
+
+    objects = IngredientPostingQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Рецепт с ингредиентом'
+        verbose_name_plural = 'Индекс рецептов по ингредиентам'
+        indexes = [
+            models.Index(
+                fields=['ingredient', 'recipe', 'ingredients_count'],
+                name='ingredient_posting_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient_id} -> {self.recipe_id}'
+
+
+class UserRecipeQuerySet(models.QuerySet):
+    """
+    Добавление и удаление рецепта из избранного или списка покупок
+    одним запросом без предварительной проверки, безопасное при
+    параллельных запросах. Сигналы модели отправляются вручную,
+    чтобы обновились счётчики и кеши.
+    """
+
+    def add(self, user, recipe_id):
+        """
+        Добавляет рецепт; False, если он уже был добавлен.
+        ValueError, если recipe_id не число.
+        """
+        recipe_id = int(recipe_id)
+        using = self._db or router.db_for_write(self.model)
+        connection = connections[using]
+        ops = connection.ops
+        sql = '{} {} (user_id, recipe_id) VALUES (%s, %s) {}'.format(
+            ops.insert_statement(ignore_conflicts=True),
+            ops.quote_name(self.model._meta.db_table),
+            ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+        )
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, recipe_id])
+            if cursor.rowcount != 1:
+                return False
+            post_save.send(
+                sender=self.model, created=True, raw=False, using=using,
+                update_fields=None,
+                instance=self.model(user=user, recipe_id=recipe_id),
+            )
+        return True
+
+    def remove(self, user, recipe_id):
+        """
+        Удаляет рецепт; False, если его не было.
+        ValueError, если recipe_id не число.
+        """
+        recipe_id = int(recipe_id)
+        using = self._db or router.db_for_write(self.model)
+        connection = connections[using]
+        sql = 'DELETE FROM {} WHERE user_id = %s AND recipe_id = %s'.format(
+            connection.ops.quote_name(self.model._meta.db_table)
+        )
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, recipe_id])
+            if cursor.rowcount != 1:
+                return False
+            post_delete.send(
+                sender=self.model, using=using,
+                instance=self.model(user=user, recipe_id=recipe_id),
+            )
+        return True
+
 
 class Favorite(models.Model):
     """Модель избранного."""
@@ -163,6 +444,8 @@ class Favorite(models.Model):
         verbose_name='Рецепт',
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ('user',)
         verbose_name = 'Избранный рецепт'
@@ -193,6 +476,8 @@ class ShoppingCart(models.Model):
         verbose_name='Рецепт',
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Корзина покупок'
         verbose_name_plural = 'Корзина покупок'
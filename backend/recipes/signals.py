@@ -0,0 +1,90 @@
+from django.db import connections
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import (m2m_changed, post_delete,
+                                      post_migrate, post_save)
+from django.dispatch import receiver
+
+from users.models import Subscribe, User
+from .fulltext import repair_sqlite_triggers
+from .models import (Favorite, IngredientInRecipe, IngredientPosting, Recipe,
+                     ShoppingCart)
+
+# Модель-источник, модель со счётчиком, внешний ключ и поле счётчика.
+COUNTERS = (
+    (Favorite, Recipe, 'recipe_id', 'favorites_count'),
+    (ShoppingCart, Recipe, 'recipe_id', 'cart_count'),
+    (Recipe, User, 'author_id', 'recipes_count'),
+    (Subscribe, User, 'author_id', 'subscribers_count'),
+)
+
+
+def change_counters(model, pks, field, delta):
+    """Атомарно меняет счётчики одним UPDATE, не опуская их ниже нуля."""
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, Value(0))}
+    )
+
+
+def change_counter(model, pk, field, delta):
+    change_counters(model, [pk], field, delta)
+
+
+def get_counter(sender):
+    """Модель со счётчиком, внешний ключ и поле счётчика для sender."""
+    for counter in COUNTERS:
+        if counter[0] is sender:
+            return counter[1:]
+    raise LookupError(f'Для {sender.__name__} нет счётчика')
+
+
+def connect_counter(sender, target, foreign_key, field):
+    def created(instance, created, raw=False, **kwargs):
+        if created and not raw:
+            change_counter(target, getattr(instance, foreign_key), field, 1)
+
+    def deleted(instance, **kwargs):
+        change_counter(target, getattr(instance, foreign_key), field, -1)
+
+    post_save.connect(created, sender=sender, weak=False,
+                      dispatch_uid=f'{field}_created')
+    post_delete.connect(deleted, sender=sender, weak=False,
+                        dispatch_uid=f'{field}_deleted')
+
+
+for counter in COUNTERS:
+    connect_counter(*counter)
+
+
+@receiver(post_migrate)
+def search_index_migrated(sender, using, **kwargs):
+    if sender.name == 'recipes':
+        repair_sqlite_triggers(connections[using])
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_ingredients_changed(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    """Индекс по ингредиентам при add, remove, set и clear (админка)."""
+    if reverse and action == 'pre_clear':
+        instance.cleared_recipe_ids = list(
+            instance.recipes.values_list('id', flat=True)
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        recipe_ids = instance.cleared_recipe_ids
+    else:
+        recipe_ids = pk_set
+    IngredientPosting.objects.rebuild(recipe_ids)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def ingredient_amount_saved(sender, instance, created, raw=False, **kwargs):
+    """Строка IngredientInRecipe общая, её ингредиент есть во всех рецептах."""
+    if not created and not raw:
+        IngredientPosting.objects.rebuild(
+            instance.recipes.values_list('id', flat=True)
+        )
@@ -1,4 +1,6 @@
 from django.contrib.auth import get_user_model
+from django.db.models import (BooleanField, Prefetch, Value,
+                              prefetch_related_objects)
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import status
@@ -6,8 +8,11 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from api.bulk import AUTHOR_ERRORS, bulk_response
 from api.pagination import CustomPagination
-from api.serializers import CustomUserSerializer, SubscribeSerializer
+from api.serializers import (CustomUserSerializer, SubscribeSerializer,
+                             get_recipes_limit)
+from recipes.models import Recipe
 from .models import Subscribe
 
 User = get_user_model()
@@ -45,6 +50,18 @@ class CustomUserViewSet(UserViewSet):
             subscription.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='subscribe',
+        url_name='subscribe-bulk'
+    )
+    def subscribe_bulk(self, request):
+        """Метод для подписки/отписки сразу от нескольких авторов."""
+        return bulk_response(request, Subscribe, AUTHOR_ERRORS,
+                             forbidden={request.user.id})
+
     @action(
         detail=False,
         permission_classes=[IsAuthenticated]
@@ -52,8 +69,20 @@ class CustomUserViewSet(UserViewSet):
     def subscriptions(self, request):
         """Метод для просмотра подписок на авторов."""
         user = request.user
-        queryset = User.objects.filter(subscribing__user=user)
+        queryset = User.objects.filter(subscribing__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        )
         pages = self.paginate_queryset(queryset)
+        recipes = Recipe.objects.all()
+        limit = get_recipes_limit(request)
+        if limit:
+            recipes = recipes.latest_per_author(
+                [author.id for author in pages], limit
+            )
+        prefetch_related_objects(
+            pages, Prefetch('recipes', queryset=recipes,
+                            to_attr='limited_recipes')
+        )
         serializer = SubscribeSerializer(pages,
                                          many=True,
                                          context={'request': request})